@@ -0,0 +1,81 @@
+# coding: utf-8
+'''
+Exportación de listados de la administración a CSV y TSV, con los mismos
+campos que la planilla (get_excel_fields).
+
+Es la exportación para procesar los datos, no para leerlos: los valores van
+tal cual (fechas ISO, números con punto) y el archivo se manda mientras se
+escribe. Si todos los campos son campos simples del modelo las filas se leen
+con values_list, sin armar instancias; si no se leen los objetos (con
+select_related de las claves foráneas).
+'''
+from datetime import datetime
+from django.http import HttpResponse
+from django.utils.encoding import smart_str
+
+from adminextras.admin.excel import (get_excel_fields, iter_queryset,
+    FORMATO_FECHA_ARCHIVO)
+from adminextras.datatables.csvstream import csv_stream
+from adminextras.datatables.streaming import closing_connection
+
+CSV_FORMATS = {
+    'csv': ('text/csv', {}),
+    'tsv': ('text/tab-separated-values', {'delimiter': '\t'}),
+}
+
+def _plain_fields(model, names):
+    ''' True si todos son campos del modelo que no son relaciones '''
+    fields = dict((field.name, field) for field in model._meta.fields)
+    for name in names:
+        field = fields.get(name)
+        if field is None or field.rel:
+            return False
+    return True
+
+def _value(obj, name):
+    value = getattr(obj, name, '')
+    if callable(value):
+        value = value()
+    return value
+
+def csv_rows(modeladmin, queryset, nombres):
+    ''' Las filas de la exportación, como tuplas '''
+    campos = nombres.keys()
+    model = modeladmin.model
+    if _plain_fields(model, campos):
+        return iter_queryset(queryset, values = campos)
+    related = [field.name for field in model._meta.fields
+               if field.rel and field.name in campos]
+    if related:
+        queryset = queryset.select_related(*related)
+    return ([_value(obj, nombre) for nombre in campos]
+            for obj in iter_queryset(queryset))
+
+def csv_response(modeladmin, request, queryset, format = 'csv'):
+    mimetype, fmtparams = CSV_FORMATS[format]
+    nombres = get_excel_fields(modeladmin, request)
+    rows = csv_rows(modeladmin, queryset, nombres)
+    header = [unicode(titulo) for titulo in nombres.values()]
+    nombre = unicode(modeladmin.model._meta.verbose_name_plural)
+    fecha = datetime.now().strftime(FORMATO_FECHA_ARCHIVO)
+    fname = ('Listado de %s %s.%s' % (nombre, fecha, format)).replace(' ', '_')
+    response = HttpResponse(closing_connection(csv_stream(header, rows, **fmtparams),
+                                               queryset.db), mimetype = mimetype)
+    response['Content-Disposition'] = 'attachment; filename=%s' % smart_str(fname)
+    return response
+
+def to_csv_admin_action(modeladmin, request, queryset):
+    '''
+    Exportar a CSV
+    '''
+    return csv_response(modeladmin, request, queryset, 'csv')
+
+to_csv_admin_action.short_description = "Exportar CSV de los elementos seleccionados"
+
+def to_tsv_admin_action(modeladmin, request, queryset):
+    '''
+    Exportar a TSV (separado por tabs)
+    '''
+    return csv_response(modeladmin, request, queryset, 'tsv')
+
+to_tsv_admin_action.short_description = "Exportar TSV de los elementos seleccionados"
@@ -1,43 +1,210 @@
 # coding: utf-8
-import xlwt
+'''
+Exportación de listados de la administración a planillas XLSX.
+
+Las filas se escriben a medida que se leen de la base (ver admin.xlsx) y la
+planilla se manda de a pedazos desde un archivo temporal, así que la memoria
+no depende de la cantidad de filas. Cuando una hoja se llena (1048576 filas)
+se sigue en otra.
+
+Las filas se leen de a EXCEL_CHUNK_SIZE (ver iter_queryset).
+'''
+import inspect
+import logging
+import time as _time
+from operator import attrgetter
 from datetime import date, time, datetime
-from django.db import models
-from cStringIO import StringIO
+from django.db import models, connections, transaction
 from django.utils.datastructures import SortedDict
 from django.conf import settings
 from itertools import *
 from django.http import HttpResponse
 from django.utils.encoding import smart_str
+from django.utils.safestring import mark_safe
 from decimal import Decimal
 
-'''
-Estilos para las planillas
-''' 
-default = xlwt.XFStyle()
-excel_date_fmt = 'D/M/YY'
-style = xlwt.XFStyle()
-style.num_format_str = excel_date_fmt
-
-QUERYSET_LIMIT = 100
+from adminextras.admin.xlsx import (XLSXWriter, iter_file, cell, text_cell,
+    number_cell, date_cell, XLSX_MIMETYPE)
+from adminextras.datatables.keyset import keyset_ordering, iterate_keyset
+
+EXCEL_CHUNK_SIZE = getattr(settings, 'EXCEL_CHUNK_SIZE', 1000)
 FORMATO_FECHA = settings.DATE_INPUT_FORMATS[0]
 FORMATO_FECHA_ARCHIVO = '%d-%m-%Y'
 
-decimal_style = xlwt.easyxf("", "#,###.00")
 
+#===============================================================================
+# Plan de columnas
+#===============================================================================
+def _skip_none(converter):
+    def convert(ref, value, style):
+        if value is None:
+            return u''
+        return converter(ref, value, style)
+    return convert
 
-def _dump_cellval(value):
-    if isinstance(value, basestring):
-        return value, default
-    elif isinstance(value, date):
-        return value.strftime(FORMATO_FECHA), style
-    elif isinstance(value, Decimal):
-        return value, decimal_style
-    elif isinstance(value, bool):
-        return (value and "Sí" or "No"), default
+def _yes_no_cell(ref, value, style):
+    return text_cell(ref, value and u"Sí" or u"No", style)
+
+def _unicode_cell(ref, value, style):
+    return text_cell(ref, unicode(value), style)
+
+def _float_cell(ref, value, style):
+    return number_cell(ref, repr(float(value)), style)
+
+def _any_cell(ref, value, style):
+    ''' Para los métodos y propiedades, que no se sabe qué devuelven '''
+    if isinstance(value, bool):
+        return _yes_no_cell(ref, value, XLSXWriter.DEFAULT)
     elif isinstance(value, models.Model):
-        return unicode(value), default
-    else:
-        return value, default
+        return _unicode_cell(ref, value, XLSXWriter.DEFAULT)
+    return cell(ref, value)
+
+# Clase de campo -> (celda, estilo), la primera que corresponda
+FIELD_CELLS = (
+    (models.ForeignKey, _skip_none(_unicode_cell), XLSXWriter.DEFAULT),
+    (models.BooleanField, _yes_no_cell, XLSXWriter.DEFAULT),
+    (models.NullBooleanField, _skip_none(_yes_no_cell), XLSXWriter.DEFAULT),
+    (models.DateTimeField, _skip_none(date_cell), XLSXWriter.DATETIME),
+    (models.DateField, _skip_none(date_cell), XLSXWriter.DATE),
+    (models.DecimalField, _skip_none(number_cell), XLSXWriter.DECIMAL),
+    (models.FloatField, _skip_none(_float_cell), XLSXWriter.DEFAULT),
+    (models.IntegerField, _skip_none(number_cell), XLSXWriter.DEFAULT),
+    (models.AutoField, _skip_none(number_cell), XLSXWriter.DEFAULT),
+    (models.CharField, _skip_none(text_cell), XLSXWriter.DEFAULT),
+    (models.TextField, _skip_none(text_cell), XLSXWriter.DEFAULT),
+)
+
+def _field_cell(field):
+    if field.choices:
+        # El valor guardado, como estaba
+        return _any_cell, None
+    for field_class, converter, style in FIELD_CELLS:
+        if isinstance(field, field_class):
+            return converter, style
+    return _any_cell, None
+
+def _method_getter(model, name):
+    '''
+    Lee el atributo name de las instancias. Los métodos se buscan una vez
+    en la clase, lo demás (propiedades...) se lee y si es callable se llama.
+    '''
+    attr = getattr(model, name, None)
+    if inspect.ismethod(attr) and attr.im_self is None:
+        function = attr.im_func
+        return lambda obj: function(obj)
+    def getter(obj):
+        value = getattr(obj, name, '')
+        if callable(value):
+            value = value()
+        return value
+    return getter
+
+def column_plan(model, campos):
+    '''
+    Arma una vez, a partir de los tipos de los campos, cómo se lee y se
+    escribe cada columna.
+    @return: (funciones que leen cada valor de una instancia, funciones que
+    arman cada celda, estilos)
+    '''
+    fields = dict((field.name, field) for field in model._meta.fields)
+    getters, converters, styles = [], [], []
+    for nombre in campos:
+        field = fields.get(nombre)
+        if field is None:
+            getters.append(_method_getter(model, nombre))
+            converter, style = _any_cell, None
+        else:
+            getters.append(attrgetter(nombre))
+            converter, style = _field_cell(field)
+        converters.append(converter)
+        styles.append(style)
+    return getters, converters, styles
+
+logger = logging.getLogger('adminextras.admin.excel')
+
+SNAPSHOT_SQL = {
+    'postgresql': 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ',
+    'mysql': 'START TRANSACTION WITH CONSISTENT SNAPSHOT',
+}
+
+def reads_in_snapshot(using):
+    '''
+    True si iter_queryset lee en una transacción propia: lo que se escriba
+    por la misma conexión mientras tanto no se ve hasta que termina.
+    '''
+    return (connections[using].vendor in SNAPSHOT_SQL and
+            not transaction.is_managed(using = using))
+
+def _begin_snapshot(using):
+    '''
+    Empieza una transacción que ve la base como estaba al empezar, en las
+    bases que lo permiten y si no hay ya una transacción manejada.
+    @return: True si hay que terminarla con _end_snapshot
+    '''
+    if not reads_in_snapshot(using):
+        return False
+    transaction.enter_transaction_management(using = using)
+    transaction.managed(True, using = using)
+    # Cerrar la transacción implícita de las consultas anteriores
+    transaction.commit(using = using)
+    connections[using].cursor().execute(SNAPSHOT_SQL[connections[using].vendor])
+    return True
+
+def _end_snapshot(using):
+    try:
+        transaction.commit(using = using)
+    finally:
+        transaction.leave_transaction_management(using = using)
+
+def _queryset_ordering(queryset):
+    query = queryset.query
+    if query.order_by:
+        return query.order_by
+    if query.default_ordering:
+        return queryset.model._meta.ordering
+    return []
+
+def iter_queryset(queryset, chunk_size = EXCEL_CHUNK_SIZE, values = None):
+    '''
+    Recorre el queryset de a chunk_size filas, pidiendo cada bloque después
+    de la última fila del anterior (ver datatables.keyset) en lugar de con
+    OFFSET. Se ordena como el queryset si se puede, por pk si no.
+    En PostgreSQL y MySQL los bloques se leen en una misma transacción, así
+    que no se saltean ni se repiten filas si la tabla cambia mientras tanto.
+    Los tiempos de cada bloque van al logger adminextras.admin.excel.
+    @param values: Campos a leer con values_list, las filas son tuplas con
+    esos campos en lugar de instancias
+    '''
+    using = queryset.db
+    ordering = keyset_ordering(queryset.model, _queryset_ordering(queryset)) or ['pk']
+    name = queryset.model._meta.object_name
+    key = None
+    if values is not None:
+        # Los campos del orden van al final, para buscar el bloque siguiente
+        count = len(values)
+        queryset = queryset.values_list(*(list(values) +
+                                          [f.lstrip('-') for f in ordering]))
+        key = lambda row: row[count:]
+    stats = {'chunks': 0, 'rows': 0, 'seconds': 0.0}
+    def on_chunk(rows, seconds):
+        stats['chunks'] += 1
+        stats['rows'] += rows
+        stats['seconds'] += seconds
+        logger.debug("%s: bloque %d, %d filas en %.3fs", name, stats['chunks'],
+                     rows, seconds)
+    snapshot = _begin_snapshot(using)
+    begin = _time.time()
+    try:
+        for row in iterate_keyset(queryset, ordering, chunk_size, on_chunk, key):
+            if key is not None:
+                row = row[:count]
+            yield row
+    finally:
+        if snapshot:
+            _end_snapshot(using)
+        logger.info("%s: %d filas en %d bloques, %.3fs de consultas, %.3fs en total",
+                    name, stats['rows'], stats['chunks'], stats['seconds'],
+                    _time.time() - begin)
 
 # Pasar a títulos
 title_case = lambda t: (t.lower() == t) and t.title() or t
@@ -103,63 +270,66 @@ def get_excel_fields(model_admin, request = None):
     
     
 
-def to_excel_admin_action(modeladmin, request, queryset):
+def write_excel(modeladmin, queryset, request = None, nombres = None,
+                fileobj = None, progress = None):
     '''
-    Exportar a excel
+    Escribe la planilla del queryset con los campos de get_excel_fields.
+    @param nombres: Los campos y sus títulos, si ya se conocen
+    @param fileobj: Donde escribir la planilla (por defecto un temporal)
+    @param progress: Se llama con las filas escritas cada EXCEL_CHUNK_SIZE
+    @return: (archivo con la planilla, nombre del archivo)
     '''
-    #queryset.update(status='p')
-    estilo_titulos = xlwt.easyxf('font: bold on; align: wrap on, vert centre, horiz center')
     model_meta = modeladmin.model._meta
-    f = StringIO()
-    
-    #nombres = SortedDict(map(lambda f: (f.name, f.verbose_name), model_meta.fields))
-    nombres = get_excel_fields(modeladmin)
-    
-    
-    planilla = xlwt.Workbook(encoding='utf-8')
-    
+    if nombres is None:
+        nombres = get_excel_fields(modeladmin, request)
     
     nombre = unicode(model_meta.verbose_name_plural)
-    hoja = planilla.add_sheet(nombre)
+    planilla = XLSXWriter(nombre)
     
     fecha = datetime.now().strftime(FORMATO_FECHA_ARCHIVO)
-    fname = 'Listado de %s %s.xls' % (nombre, fecha)
+    fname = 'Listado de %s %s.xlsx' % (nombre, fecha)
     fname = fname.replace(' ', '_')
-    #fname = 'Listado.xls' 
-    
-    cantidad = queryset.count()
-    qs = queryset.all()
-    
-    iter_inicio = xrange(0, cantidad, QUERYSET_LIMIT)
-    iter_fin = xrange(QUERYSET_LIMIT, cantidad + QUERYSET_LIMIT, QUERYSET_LIMIT)
-    
-    fila = 0
-    hoja.write_merge(fila, fila, 0, len(nombres), title_case(nombre), estilo_titulos)
-    
-    fila = 1
-    for pos, nombre in enumerate(nombres.keys()):
-        titulo = title_case(nombres[nombre])
-        hoja.write(fila, pos, titulo, estilo_titulos)
-        
-    fila = 2
-    for inicio, fin in izip(iter_inicio, iter_fin):
-        qs_slice =  qs[inicio: fin]
-        for obj in qs_slice.all():
-            
-            for pos, nombre in enumerate(nombres.keys()):
-                valor, estilo = _dump_cellval(getattr(obj, nombre, ''))
-                if callable(valor):
-                    valor = valor()
-                hoja.write(fila, pos, valor, estilo)
-                
-            fila += 1
     
-    planilla.save(f)
-    f.seek(0)
+    planilla.writerow([title_case(nombre)], XLSXWriter.BOLD)
+    planilla.merge(0, 0, 0, max(len(nombres) - 1, 0))
+    planilla.writerow([title_case(titulo) for titulo in nombres.values()],
+                      XLSXWriter.BOLD)
     
+    getters, converters, estilos = column_plan(modeladmin.model, nombres.keys())
+    related = [field.name for field in modeladmin.model._meta.fields
+               if field.rel and field.name in nombres]
+    if related:
+        queryset = queryset.select_related(*related)
+    filas = 0
+    for obj in iter_queryset(queryset):
+        if progress and filas % EXCEL_CHUNK_SIZE == 0:
+            progress(filas)
+        filas += 1
+        planilla.write_cells([getter(obj) for getter in getters], estilos, converters)
     
-    response = HttpResponse(f.getvalue(),  mimetype="application/ms-excel")
+    if progress:
+        progress(filas)
+    return planilla.save(fileobj), fname
+
+def excel_response(modeladmin, request, queryset):
+    ''' La planilla del queryset, generada en el request '''
+    f, fname = write_excel(modeladmin, queryset, request)
+    response = HttpResponse(iter_file(f), mimetype = XLSX_MIMETYPE)
     response['Content-Disposition'] = 'attachment; filename=%s' % smart_str(fname)
     return response
+
+def to_excel_admin_action(modeladmin, request, queryset):
+    '''
+    Exportar a excel. Las exportaciones grandes se hacen en segundo plano
+    (ver admin.jobs).
+    '''
+    from adminextras.admin.jobs import export_in_background
+    job = export_in_background(modeladmin, request, queryset)
+    if job is not None:
+        url = '%sexcel/jobs/%d/' % (request.path, job.pk)
+        modeladmin.message_user(request, mark_safe(
+            u'La planilla se está generando, <a href="%s">ver el estado</a>.' % url))
+        return None
+    return excel_response(modeladmin, request, queryset)
     
-to_excel_admin_action.short_description = "Exportar planilla XLS de los elementos seleccionados"
+to_excel_admin_action.short_description = "Exportar planilla XLSX de los elementos seleccionados"
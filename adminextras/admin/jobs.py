@@ -0,0 +1,250 @@
+# coding: utf-8
+'''
+Exportaciones a Excel en segundo plano.
+
+Las exportaciones de más de EXCEL_BACKGROUND_ROWS filas no se generan en el
+request: se encolan como un ExportJob y el usuario consulta su estado hasta
+que puede bajar el archivo (ver CustomModelAdmin.get_urls). Si ya hay una
+exportación igual (mismo usuario, modelo, campos y consulta) pendiente o en
+curso se devuelve esa. Un trabajo en curso que no avanzó en
+EXCEL_JOBS_TIMEOUT segundos (el proceso que lo corría murió) se marca como
+fallido y no cuenta.
+
+Los trabajos los corre un pool de EXCEL_JOBS_THREADS threads del mismo
+proceso, o con EXCEL_JOBS_THREADS = 0 el comando exportjobs (el que hay que
+usar con TransactionMiddleware, el thread no vería el trabajo hasta el
+commit del request). Las filas escritas se guardan en el trabajo cada
+EXCEL_CHUNK_SIZE filas, por otra conexión si la exportación lee en una
+transacción (ver excel.iter_queryset), y la planilla terminada queda en
+EXCEL_JOBS_ROOT.
+'''
+import os
+import pickle
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+import traceback
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connections
+from django.core.exceptions import PermissionDenied
+from django.db.models.loading import get_model
+from django.utils.datastructures import SortedDict
+try:
+    from simplejson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
+
+from adminextras.models import ExportJob
+from adminextras.admin.excel import write_excel, get_excel_fields, reads_in_snapshot
+
+EXCEL_BACKGROUND_ROWS = getattr(settings, 'EXCEL_BACKGROUND_ROWS', 10000)
+EXCEL_JOBS_THREADS = getattr(settings, 'EXCEL_JOBS_THREADS', 1)
+EXCEL_JOBS_TIMEOUT = getattr(settings, 'EXCEL_JOBS_TIMEOUT', 15 * 60)
+EXCEL_JOBS_ROOT = getattr(settings, 'EXCEL_JOBS_ROOT',
+                          os.path.join(tempfile.gettempdir(), 'adminextras-exports'))
+
+logger = logging.getLogger('adminextras.admin.jobs')
+
+def _model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+def _signature(user, admin_site, model, fields, queryset):
+    query = queryset.query
+    try:
+        sql = query.get_compiler(queryset.db).as_sql()
+    except Exception:
+        # EmptyResultSet y otros, el pickle identifica igual la consulta
+        sql = pickle.dumps(query)
+    data = repr((user.pk, admin_site, _model_label(model), fields, sql))
+    return hashlib.md5(data).hexdigest()
+
+def export_in_background(modeladmin, request, queryset):
+    '''
+    @return: El ExportJob si la exportación es grande, None si no
+    '''
+    if not EXCEL_BACKGROUND_ROWS or queryset.count() <= EXCEL_BACKGROUND_ROWS:
+        return None
+    return enqueue_export(modeladmin, request, queryset)
+
+def enqueue_export(modeladmin, request, queryset):
+    '''
+    Encola la exportación del queryset, o devuelve la igual que está
+    pendiente o en curso.
+    @return: El ExportJob
+    '''
+    nombres = get_excel_fields(modeladmin, request)
+    fields = json_dumps([[name, unicode(title)] for name, title in nombres.items()])
+    site_name = modeladmin.admin_site.name
+    signature = _signature(request.user, site_name, modeladmin.model, fields, queryset)
+    expire_stale()
+    pending = ExportJob.objects.filter(signature = signature,
+                                       state__in = (ExportJob.PENDING, ExportJob.RUNNING))
+    for job in pending[:1]:
+        return job
+    job = ExportJob.objects.create(signature = signature, user = request.user,
+                                   admin_site = site_name,
+                                   model = _model_label(modeladmin.model),
+                                   fields = fields,
+                                   query = base64.b64encode(pickle.dumps(queryset.query)))
+    if EXCEL_JOBS_THREADS:
+        _get_pool().apply_async(_run_in_thread, (job.pk, ))
+    return job
+
+def expire_stale():
+    '''
+    Marca como fallidos los trabajos en curso que no avanzaron en
+    EXCEL_JOBS_TIMEOUT segundos.
+    @return: Cuántos
+    '''
+    if not EXCEL_JOBS_TIMEOUT:
+        return 0
+    now = datetime.now()
+    return ExportJob.objects.filter(state = ExportJob.RUNNING,
+                updated__lt = now - timedelta(seconds = EXCEL_JOBS_TIMEOUT)).update(
+                state = ExportJob.FAILED, finished = now,
+                error = u'Se interrumpió, no avanzó en %d segundos' % EXCEL_JOBS_TIMEOUT)
+
+def _get_modeladmin(job):
+    from adminextras.admin.modeladmin import CustomAdminSite
+    model = get_model(*job.model.split('.'))
+    return CustomAdminSite.instances[job.admin_site]._registry[model]
+
+def _progress_writer(job, using):
+    '''
+    La función que guarda las filas escritas del trabajo y la hora (ver
+    expire_stale). Si el queryset se lee en una transacción de la misma base
+    se guardan por otra conexión, por la de la exportación no se verían
+    hasta el final.
+    @param using: La base del queryset
+    @return: (función, conexión para cerrar al terminar o None)
+    '''
+    jobs = ExportJob.objects.filter(pk = job.pk, state = ExportJob.RUNNING)
+    if jobs.db != using or not reads_in_snapshot(using):
+        return (lambda rows: jobs.update(rows = rows, updated = datetime.now())), None
+    connection = connections[using]
+    own = connection.__class__(connection.settings_dict, using)
+    quote_name = own.ops.quote_name
+    opts = ExportJob._meta
+    sql = 'UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s AND %s = %%s' % (
+                quote_name(opts.db_table), quote_name(opts.get_field('rows').column),
+                quote_name(opts.get_field('updated').column), quote_name(opts.pk.column),
+                quote_name(opts.get_field('state').column))
+    def progress(rows):
+        updated = own.ops.value_to_db_datetime(datetime.now())
+        own.cursor().execute(sql, [rows, updated, job.pk, ExportJob.RUNNING])
+        own._commit()
+    return progress, own
+
+def run_job(job):
+    '''
+    Corre el trabajo, si sigue pendiente. Si mientras tanto se lo dio por
+    muerto (ver expire_stale) no se lo marca como terminado y se borra la
+    planilla, ya puede haber otro igual.
+    @return: False si otro lo había tomado
+    '''
+    # Tomarlo, puede haber otros workers
+    now = datetime.now()
+    taken = ExportJob.objects.filter(pk = job.pk, state = ExportJob.PENDING).update(
+                                state = ExportJob.RUNNING, started = now, updated = now)
+    if not taken:
+        return False
+    # Mientras siga en curso
+    jobs = ExportJob.objects.filter(pk = job.pk, state = ExportJob.RUNNING)
+    path = None
+    try:
+        modeladmin = _get_modeladmin(job)
+        queryset = modeladmin.model._default_manager.all()
+        queryset.query = pickle.loads(base64.b64decode(job.query))
+        nombres = SortedDict(json_loads(job.fields))
+        jobs.update(total = queryset.count())
+        if not os.path.isdir(EXCEL_JOBS_ROOT):
+            os.makedirs(EXCEL_JOBS_ROOT)
+        path = os.path.join(EXCEL_JOBS_ROOT, '%d.xlsx' % job.pk)
+        progress, own = _progress_writer(job, queryset.db)
+        f = open(path, 'wb')
+        try:
+            filename = write_excel(modeladmin, queryset, nombres = nombres, fileobj = f,
+                                   progress = progress)[1]
+        finally:
+            f.close()
+            if own is not None:
+                own.close()
+        if not jobs.update(state = ExportJob.DONE, filename = filename, path = path,
+                           finished = datetime.now()):
+            logger.warning("La exportación %d terminó después de darla por muerta", job.pk)
+            os.unlink(path)
+    except Exception, e:
+        logger.exception("Falló la exportación %d", job.pk)
+        if path and os.path.exists(path):
+            os.unlink(path)
+        jobs.update(state = ExportJob.FAILED, error = traceback.format_exc(),
+                    finished = datetime.now())
+    return True
+
+def run_pending():
+    '''
+    Corre los trabajos pendientes, de a uno.
+    @return: Cuántos corrió
+    '''
+    expire_stale()
+    count = 0
+    for job in ExportJob.objects.filter(state = ExportJob.PENDING).order_by('created'):
+        if run_job(job):
+            count += 1
+    return count
+
+def purge(before):
+    ''' Borra los trabajos terminados antes de before y sus archivos '''
+    old = ExportJob.objects.filter(state__in = (ExportJob.DONE, ExportJob.FAILED),
+                                   finished__lt = before)
+    for job in old:
+        if job.path and os.path.exists(job.path):
+            os.unlink(job.path)
+    count = old.count()
+    old.delete()
+    return count
+
+def job_status(job, url):
+    '''
+    El estado del trabajo, para la consulta del admin
+    @param url: La de la consulta
+    '''
+    status = dict(id = job.pk, state = job.state, rows = job.rows, total = job.total,
+                  progress = job.progress, error = job.state == ExportJob.FAILED,
+                  url = url)
+    if job.state == ExportJob.DONE:
+        status['download'] = url + 'download/'
+    return status
+
+def check_owner(request, job):
+    if job.user_id != request.user.pk and not request.user.is_superuser:
+        raise PermissionDenied
+
+#===============================================================================
+# Pool de threads
+#===============================================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(EXCEL_JOBS_THREADS)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+def _run_in_thread(pk):
+    try:
+        for job in ExportJob.objects.filter(pk = pk):
+            run_job(job)
+    finally:
+        # Los threads del pool sobreviven al request
+        for connection in connections.all():
+            connection.close()
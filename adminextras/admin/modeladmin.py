@@ -19,7 +19,11 @@ from django.conf import settings
 
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.contrib.admin import widgets as admin_widgets
-from excel import to_excel_admin_action
+from excel import to_excel_admin_action, excel_response
+from csvexport import to_csv_admin_action, to_tsv_admin_action, csv_response, CSV_FORMATS
+from jobs import export_in_background, job_status, check_owner, expire_stale
+from xlsx import iter_file, XLSX_MIMETYPE
+from adminextras.models import ExportJob
 from adminextras.responses import SimpleJsonResponse
 from django.db.models.loading import get_app
 from adminextras.admin.exceptions import NotRegisteredModel
@@ -32,13 +36,14 @@ from django.db.models.query_utils import Q
 from django.db.models.fields import CharField
 from django.utils.safestring import mark_safe
 #from dfuelerp.apps.core.fields import MontoField, ComprobanteLegalField
+import os
 import string
-from django.utils.encoding import smart_unicode, force_unicode
+from django.utils.encoding import smart_unicode, force_unicode, smart_str
 from django.template import Template
 from django.template.context import Context, RequestContext
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from adminextras.admin.debugtools import debugargs
-from django.shortcuts import render_to_response
+from django.shortcuts import render_to_response, get_object_or_404
 from django.template.defaultfilters import capfirst
 from django.views.decorators.cache import never_cache
 from django.utils.translation import ugettext_lazy, ugettext as _, ungettext
@@ -430,7 +435,8 @@ class CustomModelAdmin(ModelAdmin):
     #===========================================================================
     excel_fields = ()
     excel_exclude = ()
-    actions = ModelAdmin.actions + [to_excel_admin_action, ]
+    actions = ModelAdmin.actions + [to_excel_admin_action, to_csv_admin_action,
+                                    to_tsv_admin_action]
     
     def get_urls(self):
         '''
@@ -439,6 +445,10 @@ class CustomModelAdmin(ModelAdmin):
         urls = super(CustomModelAdmin, self).get_urls()
         my_urls = patterns('',
             (r'^excel/$', self.admin_site.admin_view(self.exportar_excel)),
+            (r'^csv/$', self.admin_site.admin_view(self.exportar_csv)),
+            (r'^excel/jobs/(?P<pk>\d+)/$', self.admin_site.admin_view(self.estado_excel)),
+            (r'^excel/jobs/(?P<pk>\d+)/download/$',
+             self.admin_site.admin_view(self.descargar_excel)),
             (r'^json_dump/?$', self.admin_site.admin_view(self.query_dump)),
             (r'^json_dump/(?P<pk>[\d\w\.\s]+)?$', self.admin_site.admin_view(self.json_dump)),
             (r'^quickview/(?P<pk>[\d\w\.\s]+)?$', self.admin_site.admin_view(self.quickview)),
@@ -455,9 +465,46 @@ class CustomModelAdmin(ModelAdmin):
     def exportar_excel(self, request):
         '''
         Vista de la administración que genera una planilla excel.
+        Si es grande se encola y se devuelve el estado del trabajo.
         '''
         queryset = self.queryset(request)
-        return to_excel_admin_action(self, request, queryset)
+        job = export_in_background(self, request, queryset)
+        if job is not None:
+            return SimpleJsonResponse(job_status(job, '%sjobs/%d/' % (request.path, job.pk)),
+                                      status = 202)
+        return excel_response(self, request, queryset)
+    
+    def exportar_csv(self, request):
+        '''
+        Vista de la administración que genera un CSV (o TSV con ?format=tsv)
+        con los campos de la planilla excel.
+        '''
+        format = request.GET.get('format', 'csv')
+        if not format in CSV_FORMATS:
+            raise Http404
+        return csv_response(self, request, self.queryset(request), format)
+    
+    def estado_excel(self, request, pk):
+        '''
+        Estado (JSON) de una exportación en segundo plano.
+        '''
+        # Un trabajo cuyo proceso murió no queda en curso para siempre
+        expire_stale()
+        job = get_object_or_404(ExportJob, pk = pk)
+        check_owner(request, job)
+        return SimpleJsonResponse(job_status(job, request.path))
+    
+    def descargar_excel(self, request, pk):
+        '''
+        Planilla de una exportación en segundo plano terminada.
+        '''
+        job = get_object_or_404(ExportJob, pk = pk, state = ExportJob.DONE)
+        check_owner(request, job)
+        if not os.path.exists(job.path):
+            raise Http404
+        response = HttpResponse(iter_file(open(job.path, 'rb')), mimetype = XLSX_MIMETYPE)
+        response['Content-Disposition'] = 'attachment; filename=%s' % smart_str(job.filename)
+        return response
     
     def json_dump(self, request, pk = None ):
         if pk:
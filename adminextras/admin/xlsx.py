@@ -0,0 +1,264 @@
+# coding: utf-8
+'''
+Escritura de planillas XLSX fila por fila.
+
+Las filas se escriben como XML a un archivo temporal a medida que llegan y
+el libro (un zip) se arma al final en un SpooledTemporaryFile, así que la
+memoria no depende de la cantidad de filas. Los textos van como inline
+strings (sin tabla de strings compartidos, que habría que tener entera en
+memoria). Cuando una hoja llega a XLSX_MAX_ROWS filas se sigue en otra.
+
+    writer = XLSXWriter(u'Facturas')
+    writer.writerow([u'Número', u'Fecha'], XLSXWriter.BOLD)
+    for factura in facturas:
+        writer.writerow([factura.numero, factura.fecha])
+    f = writer.save()
+    response = HttpResponse(iter_file(f), mimetype = XLSX_MIMETYPE)
+'''
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from xml.sax.saxutils import escape, quoteattr
+from django.conf import settings
+from django.utils.encoding import force_unicode
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Filas por hoja de Excel 2007
+XLSX_MAX_ROWS = 1048576
+# Hasta cuántos bytes el libro queda en memoria antes de pasar a disco
+XLSX_SPOOL_SIZE = getattr(settings, 'XLSX_SPOOL_SIZE', 5 * 1024 * 1024)
+
+_ILLEGAL_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EPOCH = datetime(1899, 12, 30)
+
+_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+%s
+</Types>'''
+_SHEET_CONTENT_TYPE = '<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+
+_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>%s</sheets>
+</workbook>'''
+_WORKBOOK_SHEET = '<sheet name=%s sheetId="%d" r:id="rId%d"/>'
+
+_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+%s
+<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+_WORKBOOK_SHEET_REL = '<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet%d.xml"/>'
+
+# Los índices de cellXfs son los estilos de XLSXWriter
+_STYLES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="d/m/yy"/><numFmt numFmtId="165" formatCode="d/m/yy h:mm"/></numFmts>
+<fonts count="2"><font><sz val="10"/><name val="Arial"/></font><font><b/><sz val="10"/><name val="Arial"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center" wrapText="1"/></xf>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>'''
+
+_SHEET_HEAD = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'''
+
+
+def column_letter(n):
+    ''' 0 -> A, 26 -> AA '''
+    letters = ''
+    n += 1
+    while n:
+        n, rest = divmod(n - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+#===============================================================================
+# Celdas
+#===============================================================================
+def text_cell(ref, value, style = 0):
+    value = _ILLEGAL_XML.sub(u'', force_unicode(value))
+    return u'<c r="%s" s="%d" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % (
+                ref, style, escape(value))
+
+def number_cell(ref, value, style = 0):
+    return u'<c r="%s" s="%d"><v>%s</v></c>' % (ref, style, value)
+
+def bool_cell(ref, value, style = 0):
+    return u'<c r="%s" s="%d" t="b"><v>%d</v></c>' % (ref, style, value and 1 or 0)
+
+def date_cell(ref, value, style = 0):
+    ''' Las fechas son días desde 1899-12-30 '''
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    delta = value.replace(tzinfo = None) - _EPOCH
+    serial = delta.days + delta.seconds / 86400.0
+    return u'<c r="%s" s="%d"><v>%r</v></c>' % (ref, style, serial)
+
+def cell(ref, value, style = None):
+    '''
+    La celda según el tipo del valor, con su estilo por defecto si no se
+    da uno. None queda vacía.
+    '''
+    if value is None:
+        return u''
+    elif isinstance(value, bool):
+        return bool_cell(ref, value, style or 0)
+    elif isinstance(value, (int, long)):
+        return number_cell(ref, value, style or 0)
+    elif isinstance(value, float):
+        return number_cell(ref, repr(value), style or 0)
+    elif isinstance(value, Decimal):
+        return number_cell(ref, value, style or XLSXWriter.DECIMAL)
+    elif isinstance(value, datetime):
+        return date_cell(ref, value, style or XLSXWriter.DATETIME)
+    elif isinstance(value, date):
+        return date_cell(ref, value, style or XLSXWriter.DATE)
+    return text_cell(ref, value, style or 0)
+
+
+class _Sheet(object):
+    def __init__(self, name):
+        self.name = name
+        self.file = NamedTemporaryFile(suffix = '.xml')
+        self.file.write(_SHEET_HEAD)
+        self.rows = 0
+        self.merged = []
+
+    def close(self):
+        self.file.write('</sheetData>')
+        if self.merged:
+            self.file.write('<mergeCells count="%d">%s</mergeCells>' % (
+                len(self.merged), ''.join('<mergeCell ref="%s"/>' % ref
+                                          for ref in self.merged)))
+        self.file.write('</worksheet>')
+        self.file.flush()
+
+
+class XLSXWriter(object):
+    '''
+    Planilla XLSX escrita fila por fila.
+    '''
+    # Estilos (índices de cellXfs en _STYLES)
+    DEFAULT, DATE, DATETIME, DECIMAL, BOLD = range(5)
+
+    def __init__(self, sheet_name = u'Hoja1', max_rows = XLSX_MAX_ROWS):
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self.sheets = []
+        self._letters = []
+        self._add_sheet()
+
+    def _add_sheet(self):
+        name = self.sheet_name
+        if self.sheets:
+            name = u'%s (%d)' % (name, len(self.sheets) + 1)
+        # Excel no acepta estos caracteres ni más de 31
+        name = re.sub(ur'[\[\]:*?/\\]', u'', name)[:31]
+        self.sheets.append(_Sheet(name))
+
+    def _refs(self, count):
+        while len(self._letters) < count:
+            self._letters.append(column_letter(len(self._letters)))
+        return self._letters
+
+    @property
+    def row(self):
+        ''' Número (desde 0) de la próxima fila de la hoja actual '''
+        return self.sheets[-1].rows
+
+    def writerow(self, values, styles = None):
+        '''
+        @param styles: Un estilo para toda la fila, o uno por celda (None
+        toma el del tipo del valor)
+        '''
+        self.write_cells(values, styles, cell)
+
+    def write_cells(self, values, styles = None, converters = None):
+        '''
+        Como writerow, con la función que arma cada celda
+        (ref, valor, estilo) -> XML, una sola o una por columna.
+        '''
+        sheet = self.sheets[-1]
+        if sheet.rows >= self.max_rows:
+            self._add_sheet()
+            sheet = self.sheets[-1]
+        sheet.rows += 1
+        number = sheet.rows
+        count = len(values)
+        letters = self._refs(count)
+        if not isinstance(styles, (list, tuple)):
+            styles = [styles] * count
+        if not isinstance(converters, (list, tuple)):
+            converters = [converters or cell] * count
+        cells = [converters[n]('%s%d' % (letters[n], number), values[n], styles[n])
+                 for n in xrange(count)]
+        sheet.file.write((u'<row r="%d">%s</row>' % (number, u''.join(cells))).encode('utf-8'))
+
+    def merge(self, first_row, first_column, last_row, last_column):
+        ''' Combina celdas de la hoja actual (filas y columnas desde 0) '''
+        self.sheets[-1].merged.append('%s%d:%s%d' % (
+                column_letter(first_column), first_row + 1,
+                column_letter(last_column), last_row + 1))
+
+    def save(self, fileobj = None):
+        '''
+        Arma el libro en fileobj (por defecto un SpooledTemporaryFile).
+        @return: El archivo, posicionado al principio
+        '''
+        if fileobj is None:
+            fileobj = SpooledTemporaryFile(XLSX_SPOOL_SIZE)
+        count = len(self.sheets)
+        book = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED,
+                               allowZip64 = True)
+        try:
+            book.writestr('[Content_Types].xml', _CONTENT_TYPES % '\n'.join(
+                        _SHEET_CONTENT_TYPE % (n + 1) for n in range(count)))
+            book.writestr('_rels/.rels', _RELS)
+            book.writestr('xl/workbook.xml', _WORKBOOK % ''.join(
+                        _WORKBOOK_SHEET % (quoteattr(sheet.name).encode('utf-8'), n + 1, n + 1)
+                        for n, sheet in enumerate(self.sheets)))
+            book.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS % (
+                        '\n'.join(_WORKBOOK_SHEET_REL % (n + 1, n + 1) for n in range(count)),
+                        count + 1))
+            book.writestr('xl/styles.xml', _STYLES)
+            for n, sheet in enumerate(self.sheets):
+                sheet.close()
+                book.write(sheet.file.name, 'xl/worksheets/sheet%d.xml' % (n + 1))
+        finally:
+            book.close()
+            for sheet in self.sheets:
+                sheet.file.close()
+        fileobj.seek(0)
+        return fileobj
+
+
+def iter_file(fileobj, chunk_size = 64 * 1024):
+    ''' Lee el archivo de a pedazos y lo cierra al terminar '''
+    try:
+        while True:
+            data = fileobj.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        fileobj.close()
@@ -0,0 +1,86 @@
+# encoding: utf-8
+'''
+Batches of datatable requests (see views.jq_datatable_batch).
+
+Every request of the batch is served as a copy of the HTTP request (same
+user, session and META) with its own arguments. When the database allows
+it (not SQLite, whose in memory databases are per connection) they are
+run on a pool of DATATABLE_BATCH_THREADS threads, each one with its own
+database connection, which is closed when the request is done.
+'''
+import copy
+import threading
+from django.conf import settings
+from django.db import connections
+from django.http import QueryDict
+from django.utils.datastructures import MergeDict
+from django.utils.http import urlencode
+
+DATATABLE_BATCH_THREADS = getattr(settings, 'DATATABLE_BATCH_THREADS', 4)
+DATATABLE_BATCH_MAX_REQUESTS = getattr(settings, 'DATATABLE_BATCH_MAX_REQUESTS', 20)
+
+def sub_request(request, arguments):
+    '''
+    A copy of the request with the given arguments as GET and nothing posted.
+    @param arguments: A dict, or a DataTables aoData list of {name, value}
+    '''
+    if not hasattr(arguments, 'items'):
+        arguments = [(item['name'], item['value']) for item in arguments]
+    sub = copy.copy(request)
+    sub.method = 'GET'
+    sub.GET = QueryDict(urlencode(arguments, doseq = 1))
+    sub.POST = QueryDict('')
+    sub._request = MergeDict(sub.POST, sub.GET)
+    return sub
+
+
+def can_run_concurrently():
+    if not DATATABLE_BATCH_THREADS:
+        return False
+    for alias in connections:
+        if connections[alias].vendor == 'sqlite':
+            return False
+    return True
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(DATATABLE_BATCH_THREADS)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+def _closing_connections(function):
+    def call(argument):
+        try:
+            return function(argument)
+        finally:
+            # Pool threads outlive the request
+            for connection in connections.all():
+                connection.close()
+    return call
+
+def run_in_background(function, *args):
+    '''
+    Calls function on the pool, if the database allows it.
+    @return: False if it couldn't be run
+    '''
+    if not can_run_concurrently():
+        return False
+    _get_pool().apply_async(_closing_connections(lambda args: function(*args)), (args, ))
+    return True
+
+def run_batch(function, arguments):
+    '''
+    Calls function with each of the arguments, concurrently if possible.
+    @return: The results, in the same order
+    '''
+    if len(arguments) < 2 or not can_run_concurrently():
+        return map(function, arguments)
+    return _get_pool().map(_closing_connections(function), arguments)
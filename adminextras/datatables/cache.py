@@ -0,0 +1,193 @@
+# encoding: utf-8
+'''
+Per model generation numbers.
+
+Every save or delete of an instance bumps the generation of its model, so
+anything cached under a key that includes the generations it depends on is
+invalidated without having to know which keys to delete. The signals are
+connected when this module is imported, and adminextras.models imports it,
+so every process with adminextras in INSTALLED_APPS bumps them, not only
+the ones serving datatables.
+
+The generations live in the Django cache, which has to be shared by every
+process (memcached, the database cache...): with the default LocMemCache a
+save in one worker doesn't change the generations the others read, and
+their cached counts, responses and ETags go stale. check_generations warns
+about it and refuses DummyCache where generations must be kept.
+
+QuerySet.update() and raw SQL don't send signals, call bump_generation
+after them.
+
+The serialized jq_datatable responses are cached here too, under their
+signature (which includes the generations), with hit and miss counters
+to size the cache (response_cache_stats).
+'''
+import time
+import hashlib
+import logging
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import signals, get_models
+from django.db.models.sql.datastructures import EmptyResultSet
+
+GENERATION_KEY = 'adminextras.datatables.generation.%s.%s'
+RESPONSE_KEY = 'adminextras.datatables.response.%s'
+RESPONSE_STATS_KEY = 'adminextras.datatables.response.stats.%s'
+# Long enough not to invalidate everything every few minutes
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+def _generation_key(model):
+    opts = model._meta
+    return GENERATION_KEY % (opts.app_label, opts.object_name.lower())
+
+def _initial_generation():
+    # A generation nobody could have used before, in case the key was evicted
+    return int(time.time() * 1000)
+
+def get_generation(model):
+    key = _generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _initial_generation(), GENERATION_TIMEOUT)
+        generation = cache.get(key, 0)
+    return generation
+
+def get_generations(models):
+    ''' Generations of several models, in a single cache round trip '''
+    check_generations()
+    keys = map(_generation_key, models)
+    generations = cache.get_many(keys)
+    return [generations.get(key) or get_generation(model)
+            for key, model in zip(keys, models)]
+
+def bump_generation(model):
+    key = _generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not in the cache
+        cache.set(key, _initial_generation(), GENERATION_TIMEOUT)
+
+
+_models_by_table = {}
+
+def query_models(queryset):
+    '''
+    Models whose tables take part in the queryset (the model itself and the
+    ones joined by filters), which are the ones a cached result depends on.
+    '''
+    if not _models_by_table:
+        for model in get_models(include_auto_created = True):
+            _models_by_table[model._meta.db_table] = model
+    result = [queryset.model]
+    for table in queryset.query.tables:
+        model = _models_by_table.get(table)
+        if model and model not in result:
+            result.append(model)
+    return result
+
+def queryset_signature(queryset, extra_models = ()):
+    '''
+    Identifies the rows of the queryset as they are now: a hash of its SQL,
+    its parameters and the generations of the models involved, so it changes
+    when the query or the data changes.
+    @param extra_models: Other models the cached result depends on
+    @return: The hash or None if it can't be worked out
+    '''
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return None
+    models = query_models(queryset)
+    models.extend(model for model in extra_models if model not in models)
+    generations = get_generations(models)
+    return hashlib.md5(repr((queryset.db, sql, params, generations))).hexdigest()
+
+
+#===============================================================================
+# Response cache
+#===============================================================================
+def _count(name):
+    key = RESPONSE_STATS_KEY % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First one, or evicted
+        if not cache.add(key, 1, GENERATION_TIMEOUT):
+            cache.incr(key)
+
+def get_response(signature, count = True):
+    '''
+    The cached response body, None on a miss
+    @param count: Whether it counts as a hit or a miss
+    '''
+    body = cache.get(RESPONSE_KEY % signature)
+    if count:
+        _count(body is None and 'misses' or 'hits')
+    return body
+
+def set_response(signature, body, timeout):
+    cache.set(RESPONSE_KEY % signature, body, timeout)
+
+def response_cache_stats():
+    ''' Hits and misses since the last reset_response_cache_stats '''
+    stats = cache.get_many([RESPONSE_STATS_KEY % name for name in ('hits', 'misses')])
+    hits = stats.get(RESPONSE_STATS_KEY % 'hits', 0)
+    misses = stats.get(RESPONSE_STATS_KEY % 'misses', 0)
+    return dict(hits = hits, misses = misses,
+                ratio = (hits + misses) and float(hits) / (hits + misses) or 0.0)
+
+def reset_response_cache_stats():
+    cache.delete_many([RESPONSE_STATS_KEY % name for name in ('hits', 'misses')])
+
+
+def _model_changed(sender, **kwargs):
+    bump_generation(sender)
+
+def _m2m_changed(sender, instance, model, **kwargs):
+    # sender is the intermediate model
+    for changed in set([sender, instance.__class__, model]):
+        bump_generation(changed)
+
+_SIGNALS = (
+    (signals.post_save, _model_changed, 'adminextras.datatables.post_save'),
+    (signals.post_delete, _model_changed, 'adminextras.datatables.post_delete'),
+    (signals.m2m_changed, _m2m_changed, 'adminextras.datatables.m2m_changed'),
+)
+
+def connect_signals():
+    for signal, receiver, uid in _SIGNALS:
+        signal.connect(receiver, dispatch_uid = uid)
+
+def signals_connected():
+    for signal, receiver, uid in _SIGNALS:
+        if not [key for key, _ in signal.receivers if key[0] == uid]:
+            return False
+    return True
+
+logger = logging.getLogger('adminextras.datatables.cache')
+_checked = set()
+
+def check_generations(kept = False):
+    '''
+    Checks that the generations change with the data: the signals are
+    connected and, with kept, the cache keeps them (it's not DummyCache, under
+    which they never change). A process local cache is only warned about.
+    @raise ImproperlyConfigured: If they don't
+    '''
+    if kept in _checked:
+        return
+    if not signals_connected():
+        raise ImproperlyConfigured("The signals that bump the datatables generations "
+                                   "aren't connected, see datatables.cache")
+    if kept and isinstance(cache, DummyCache):
+        raise ImproperlyConfigured("The datatables generations need a cache that keeps "
+                                   "them, not DummyCache")
+    if isinstance(cache, LocMemCache) and not _checked:
+        logger.warning("The datatables generations are in a process local cache, "
+                       "saves in other processes won't invalidate what this one caches")
+    _checked.add(kept)
+
+connect_signals()
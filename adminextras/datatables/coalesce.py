@@ -0,0 +1,77 @@
+# encoding: utf-8
+'''
+Single flight calls: concurrent identical jq_datatable requests (same
+response signature) in a process wait for the one that came first and share
+its serialized response, instead of each one counting and fetching the
+same page. Only threads of the same process are coalesced.
+
+    * DATATABLE_COALESCE_TIMEOUT: seconds a request waits for the one in
+      flight, then it does the work itself.
+    * DATATABLE_COALESCE_MAX_KEYS: different calls that can be in flight at
+      once, more calls aren't coalesced. Results are dropped as soon as the
+      waiting requests got them, so this bounds the memory too.
+'''
+import threading
+from django.conf import settings
+
+DATATABLE_COALESCE_TIMEOUT = getattr(settings, 'DATATABLE_COALESCE_TIMEOUT', 10)
+DATATABLE_COALESCE_MAX_KEYS = getattr(settings, 'DATATABLE_COALESCE_MAX_KEYS', 100)
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self, timeout = DATATABLE_COALESCE_TIMEOUT,
+                 max_keys = DATATABLE_COALESCE_MAX_KEYS):
+        self.timeout = timeout
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        '''
+        Calls function, or waits for the call with the same key that is in
+        flight and returns its result (or raises its exception).
+        '''
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None and len(self._calls) < self.max_keys
+            if leader:
+                call = self._calls[key] = _Call()
+        finally:
+            self._lock.release()
+
+        if call is None:
+            # Too many in flight
+            return function()
+        if not leader:
+            call.done.wait(self.timeout)
+            if not call.done.isSet():
+                return function()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            try:
+                call.result = function()
+            except Exception, e:
+                call.error = e
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.done.set()
+        return call.result
+
+    def __len__(self):
+        return len(self._calls)
+
+single_flight = SingleFlight()
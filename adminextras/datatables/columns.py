@@ -0,0 +1,143 @@
+# encoding: utf-8
+'''
+Column accessors for DataTableRequest.dump_queryset_data.
+
+Each column is compiled once per (model, columns) into a function that takes
+a row (a model instance or a values() dict) and returns the cell data, with
+the converter picked from the model field:
+
+    * dates: strftime(DATE_FORMAT)
+    * foreign keys: unicode of the related instance
+    * plain fields: as they are, read with operator.itemgetter/attrgetter
+    * anything else (methods, properties, reverse relations): walked like
+      attribute_getter does, calling callables on the way.
+'''
+import datetime
+from operator import attrgetter, itemgetter
+from django.conf import settings
+from django.db import models
+from django.utils.encoding import smart_unicode
+
+from adminextras.datatables.utils import resolve_lookup, is_forward_path, LOOKUP_SEP
+
+DATE_FORMAT = settings.DATE_INPUT_FORMATS[0] or '%d/%m/%Y'
+
+NOT_IN_MODEL = "Not in model"
+
+def attribute_getter(instance, name):
+    '''
+    Callable called for conversion
+    '''
+    try:
+        data = getattr(instance, name)
+        if isinstance(data, (datetime.date,)):
+            return data.strftime(DATE_FORMAT)
+        elif isinstance(data, (models.Model, )):
+            #return [data.pk, unicode(data)]
+            return data
+        elif callable(data):
+            data = data()
+
+    except AttributeError:
+        return NOT_IN_MODEL
+    return data
+
+#===============================================================================
+# Converters
+#===============================================================================
+def _format_date(value):
+    if value is None:
+        return None
+    return value.strftime(DATE_FORMAT)
+
+def _format_instance(value):
+    if value is None:
+        return None
+    return smart_unicode(value)
+
+def _format_any(value):
+    ''' For values() rows of unknown models '''
+    if isinstance(value, datetime.date):
+        return value.strftime(DATE_FORMAT)
+    return value
+
+def _field_converter(field):
+    if isinstance(field, models.DateField):
+        return _format_date
+    elif getattr(field, 'rel', None):
+        return _format_instance
+    return None
+
+#===============================================================================
+# Accessors
+#===============================================================================
+def _generic_accessor(column):
+    ''' The attribute_getter walk, for anything that is not a field '''
+    names = column.split('.')
+    def accessor(instance):
+        data = instance
+        for attr_name in names:
+            data = attribute_getter(data, attr_name)
+        if isinstance(data, models.Model):
+            data = smart_unicode(data)
+        elif isinstance(data, models.Manager):
+            # Reverse FK and m2m columns (prefetched)
+            data = u', '.join(map(smart_unicode, data.all()))
+        return data
+    return accessor
+
+def _values_accessor(model, column):
+    lookup = column.replace('.', LOOKUP_SEP)
+    getter = itemgetter(lookup)
+    if model is None:
+        converter = _format_any
+    else:
+        path = resolve_lookup(model, lookup)
+        converter = path and _field_converter(path[-1][0])
+    if converter is None:
+        return getter
+    return lambda row: converter(getter(row))
+
+def _instance_accessor(model, column):
+    path = model and resolve_lookup(model, column.replace('.', LOOKUP_SEP))
+    if not is_forward_path(path):
+        # Not a field, or a multi valued one
+        return _generic_accessor(column)
+    getter = attrgetter(column)
+    converter = _field_converter(path[-1][0])
+    if len(path) > 1:
+        # A null foreign key on the way
+        def accessor(instance):
+            try:
+                value = getter(instance)
+            except AttributeError:
+                return NOT_IN_MODEL
+            return converter(value) if converter else value
+        return accessor
+    if converter is None:
+        return getter
+    return lambda instance: converter(getter(instance))
+
+
+_accessors_cache = {}
+# Column lists come from the client, don't let them grow the cache forever
+ACCESSORS_CACHE_SIZE = 512
+
+def compile_columns(model, columns, values_rows = False):
+    '''
+    @param model: The model of the rows, None if unknown
+    @param columns: The DataTableRequest columns
+    @param values_rows: If the rows are values() dicts
+    @return: A list of accessors, one per column
+    '''
+    key = (model, tuple(columns), values_rows)
+    accessors = _accessors_cache.get(key)
+    if accessors is None:
+        if values_rows:
+            accessors = [_values_accessor(model, column) for column in columns]
+        else:
+            accessors = [_instance_accessor(model, column) for column in columns]
+        if len(_accessors_cache) >= ACCESSORS_CACHE_SIZE:
+            _accessors_cache.clear()
+        _accessors_cache[key] = accessors
+    return accessors
@@ -0,0 +1,141 @@
+# encoding: utf-8
+'''
+Count strategies for jq_datatable's iTotalRecords/iTotalDisplayRecords.
+
+    * exact: queryset.count(), what DataTables expects, but a full scan on
+      big tables.
+    * cached: exact count cached per query signature (the SQL and its
+      parameters, so filters and row level restrictions are part of it) and
+      per generation of the models involved (see datatables.cache).
+    * estimated: the planner statistics of the table for unfiltered querysets
+      bigger than DATATABLE_COUNT_ESTIMATE_THRESHOLD, cached count otherwise.
+      The response carries bCountEstimated.
+    * lazy: the page is sent without counting (bCountPending) and the client
+      asks for the cached count to the count/ view afterwards.
+
+DATATABLE_COUNT_STRATEGY selects one by name, or gives the dotted path of a
+CountStrategy subclass.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, DatabaseError
+from django.utils.importlib import import_module
+
+from adminextras.datatables.cache import queryset_signature
+
+DATATABLE_COUNT_STRATEGY = getattr(settings, 'DATATABLE_COUNT_STRATEGY', 'exact')
+DATATABLE_COUNT_CACHE_TIMEOUT = getattr(settings, 'DATATABLE_COUNT_CACHE_TIMEOUT', 60 * 10)
+DATATABLE_COUNT_ESTIMATE_THRESHOLD = getattr(settings, 'DATATABLE_COUNT_ESTIMATE_THRESHOLD', 100000)
+
+COUNT_KEY = 'adminextras.datatables.count.%s'
+
+class CountStrategy(object):
+    '''
+    Exact count. Subclasses override count()
+    '''
+    # The page is sent before counting
+    lazy = False
+
+    def __init__(self):
+        # Set by count() when the result is not exact
+        self.estimated = False
+
+    def count(self, queryset):
+        return queryset.count()
+
+class CachedCount(CountStrategy):
+    timeout = DATATABLE_COUNT_CACHE_TIMEOUT
+
+    def signature(self, queryset):
+        ''' Identifies the rows counted, None if it can't be worked out '''
+        return queryset_signature(queryset.order_by())
+
+    def count(self, queryset):
+        signature = self.signature(queryset)
+        if signature is None:
+            return super(CachedCount, self).count(queryset)
+        key = COUNT_KEY % signature
+        total = cache.get(key)
+        if total is None:
+            total = super(CachedCount, self).count(queryset)
+            cache.set(key, total, self.timeout)
+        return total
+
+class EstimatedCount(CachedCount):
+    threshold = DATATABLE_COUNT_ESTIMATE_THRESHOLD
+
+    def count(self, queryset):
+        query = queryset.query
+        if not (query.where or query.having or query.extra or query.distinct):
+            estimate = estimate_rows(queryset)
+            if estimate is not None and estimate >= self.threshold:
+                self.estimated = True
+                return estimate
+        return super(EstimatedCount, self).count(queryset)
+
+class LazyCount(CachedCount):
+    lazy = True
+
+
+def estimate_rows(queryset):
+    '''
+    Number of rows of the queryset table according to the database
+    statistics, None if the backend has none (or they were never gathered).
+    '''
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+        params = [connection.ops.quote_name(table)]
+    elif vendor == 'mysql':
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+        params = [table]
+    elif vendor == 'oracle':
+        sql = "SELECT num_rows FROM user_tables WHERE table_name = %s"
+        params = [table.upper()]
+    elif vendor == 'sqlite':
+        # Only after ANALYZE, the first number of stat is the row count
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+        params = [table]
+    else:
+        return None
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(float(str(row[0]).split()[0]))
+    if estimate <= 0:
+        # Never analyzed
+        return None
+    return estimate
+
+
+COUNT_STRATEGIES = {
+    'exact': CountStrategy,
+    'cached': CachedCount,
+    'estimated': EstimatedCount,
+    'lazy': LazyCount,
+}
+
+def get_count_strategy(name = None):
+    '''
+    @param name: A COUNT_STRATEGIES key, a dotted path to a CountStrategy
+    subclass or the class itself. Defaults to DATATABLE_COUNT_STRATEGY.
+    @return: A new strategy instance
+    '''
+    name = name or DATATABLE_COUNT_STRATEGY
+    if isinstance(name, basestring):
+        if name in COUNT_STRATEGIES:
+            strategy_class = COUNT_STRATEGIES[name]
+        else:
+            module, class_name = name.rsplit('.', 1)
+            strategy_class = getattr(import_module(module), class_name)
+    else:
+        strategy_class = name
+    return strategy_class()
@@ -0,0 +1,34 @@
+# encoding: utf-8
+'''
+CSV written while it's sent, for the datatable and admin exports.
+
+It only depends on the stdlib and Django, so any module can import it
+(datatables.export pulls in the admin package through admin.xlsx).
+'''
+import csv
+from cStringIO import StringIO
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+DATATABLE_EXPORT_CHUNK = getattr(settings, 'DATATABLE_EXPORT_CHUNK', 1000)
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    return smart_str(value)
+
+def csv_stream(header, rows, chunk_size = DATATABLE_EXPORT_CHUNK, **fmtparams):
+    '''
+    Yields the CSV (utf-8) of the rows in chunks of chunk_size rows.
+    @param fmtparams: csv.writer format parameters (delimiter...)
+    '''
+    buffer = StringIO()
+    writer = csv.writer(buffer, **fmtparams)
+    writer.writerow(map(_csv_value, header))
+    for n, row in enumerate(rows):
+        writer.writerow(map(_csv_value, row))
+        if n % chunk_size == chunk_size - 1:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,48 @@
+# encoding: utf-8
+'''
+Distinct values of a datatable column, for the column filter dropdowns.
+
+They are counted with a single GROUP BY, limited to DATATABLE_VALUES_LIMIT
+values: columns with more values than that get bTooManyValues instead of a
+list nobody would scroll. The result is cached for
+DATATABLE_VALUES_CACHE_TIMEOUT seconds under the signature of the query,
+which changes with the generations of the models involved (see
+datatables.cache), so saving or deleting rows drops it.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from adminextras.datatables.cache import queryset_signature
+from adminextras.datatables.columns import compile_columns
+
+DATATABLE_VALUES_LIMIT = getattr(settings, 'DATATABLE_VALUES_LIMIT', 100)
+DATATABLE_VALUES_CACHE_TIMEOUT = getattr(settings, 'DATATABLE_VALUES_CACHE_TIMEOUT', 60 * 10)
+
+VALUES_KEY = 'adminextras.datatables.values.%s'
+
+def distinct_values(queryset, column, lookup, limit = DATATABLE_VALUES_LIMIT):
+    '''
+    @param column: The column, for the cell format
+    @param lookup: Its query lookup, a field reachable by forward relations
+    @return: A list of [value, count] sorted by value, or None if there are
+    more than limit values
+    '''
+    queryset = queryset.values(lookup).annotate(datatable_count = Count('pk'))
+    queryset = queryset.order_by(lookup)[:limit + 1]
+    signature = queryset_signature(queryset)
+    key = signature and VALUES_KEY % signature
+    if key:
+        values = cache.get(key)
+        if values is not None:
+            # Cached as a tuple so None (too many) can be told from a miss
+            return values[0]
+    rows = list(queryset)
+    if len(rows) > limit:
+        values = None
+    else:
+        accessor = compile_columns(queryset.model, [column], True)[0]
+        values = [[accessor(row), row['datatable_count']] for row in rows]
+    if key:
+        cache.set(key, (values, ), DATATABLE_VALUES_CACHE_TIMEOUT)
+    return values
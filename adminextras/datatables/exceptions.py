@@ -0,0 +1,15 @@
+''' Excepciones '''
+class DataTableArgumentsException(Exception):
+    pass
+
+class InvalidColumn(DataTableArgumentsException):
+    pass
+
+class InvalidModel(DataTableArgumentsException):
+    pass
+
+class ResourceNotFound(DataTableArgumentsException):
+    pass
+
+class UnindexedSort(InvalidColumn):
+    pass
@@ -0,0 +1,39 @@
+# encoding: utf-8
+'''
+Exports of what a datatable shows (see views.jq_datatable_export): the same
+columns, ordering and search, with all the rows.
+
+Rows are read in chunks of DATATABLE_EXPORT_CHUNK rows, seeking on the
+ordering when it allows it (see keyset.iterate_keyset), so the memory taken
+doesn't depend on the number of rows:
+
+    * csv: sent while it's written.
+    * xlsx: written to temporary files (see adminextras.admin.xlsx) and
+      sent in chunks once complete.
+'''
+from adminextras.admin.xlsx import XLSXWriter
+from adminextras.datatables.csvstream import csv_stream, DATATABLE_EXPORT_CHUNK
+from adminextras.datatables.keyset import iterate_keyset
+from adminextras.datatables.streaming import iterate
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+def export_rows(queryset, ordering = None, chunk_size = DATATABLE_EXPORT_CHUNK):
+    '''
+    Iterates every row of the queryset.
+    @param ordering: The keyset_ordering of the queryset, None if it can't
+    be used (then it's read with iterator())
+    '''
+    if ordering:
+        return iterate_keyset(queryset, ordering, chunk_size)
+    return iterate(queryset, chunk_size)
+
+def xlsx_file(header, rows, sheet_name):
+    '''
+    @return: A temporary file with the workbook
+    '''
+    writer = XLSXWriter(sheet_name)
+    writer.writerow(header, XLSXWriter.BOLD)
+    for row in rows:
+        writer.writerow(row)
+    return writer.save()
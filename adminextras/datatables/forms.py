@@ -0,0 +1,77 @@
+# encoding: utf-8
+'''
+Forms served by views.get_from (the add new dialogs).
+
+Only the forms listed in DATATABLE_FORMS, by dotted path, can be requested::
+
+    DATATABLE_FORMS = ('ventas.forms.ClienteForm', )
+
+Their classes are imported once, and the HTML of the unbound form is
+rendered once per language. Forms with model choices are rendered again
+when the generation of the choice models changes (see datatables.cache).
+
+DATATABLE_FORMS_WARMUP renders them when the urls are loaded: True for
+LANGUAGE_CODE, or a list of language codes.
+'''
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.importlib import import_module
+
+from adminextras.datatables.cache import get_generations
+
+DATATABLE_FORMS = getattr(settings, 'DATATABLE_FORMS', ())
+DATATABLE_FORMS_WARMUP = getattr(settings, 'DATATABLE_FORMS_WARMUP', False)
+
+FORM_TEMPLATE = 'datatables/forms/form.html'
+
+_form_classes = {}
+_form_html = {}
+# Stale generations leave entries behind
+FORMS_CACHE_SIZE = 256
+
+def get_form_class(path):
+    '''
+    @raise ImportError: If the form is not allowed or can't be imported
+    '''
+    if not path in DATATABLE_FORMS:
+        raise ImportError(u"%s is not in DATATABLE_FORMS" % path)
+    form_class = _form_classes.get(path)
+    if form_class is None:
+        module, class_name = path.rsplit('.', 1)
+        try:
+            form_class = getattr(import_module(module), class_name)
+        except AttributeError:
+            raise ImportError(u"%s has no %s" % (module, class_name))
+        _form_classes[path] = form_class
+    return form_class
+
+def _choice_models(form_class):
+    return [field.queryset.model for field in form_class.base_fields.values()
+            if getattr(field, 'queryset', None) is not None]
+
+def render_form(path):
+    '''
+    HTML of the unbound form in the active language
+    @raise ImportError: See get_form_class
+    '''
+    form_class = get_form_class(path)
+    key = (path, translation.get_language(),
+           tuple(get_generations(_choice_models(form_class))))
+    html = _form_html.get(key)
+    if html is None:
+        html = render_to_string(FORM_TEMPLATE, dict(form = form_class()))
+        if len(_form_html) >= FORMS_CACHE_SIZE:
+            _form_html.clear()
+        _form_html[key] = html
+    return html
+
+def warm_up(languages = None):
+    ''' Renders every allowed form in the languages (LANGUAGE_CODE) '''
+    for language in languages or [settings.LANGUAGE_CODE]:
+        translation.activate(language)
+        try:
+            for path in DATATABLE_FORMS:
+                render_form(path)
+        finally:
+            translation.deactivate()
@@ -0,0 +1,174 @@
+# encoding: utf-8
+'''
+Keyset (a.k.a. seek) pagination for jq_datatable.
+
+Instead of ``qs[start:start + length]``, which makes the database walk and
+throw away ``start`` rows, the next page is fetched with a WHERE clause on
+the last key seen by the client::
+
+    ORDER BY numero, id  ->  WHERE numero > 10 OR (numero = 10 AND id > 532)
+
+The key is sent to the client as an opaque cursor (sNextCursor) and comes
+back as sCursor with the next request. The cursor remembers the ordering,
+the display start and the search (scope) it's valid for, so jumping to an
+arbitrary page or changing the sort or the search silently falls back to
+OFFSET pagination.
+
+Keyset pagination is only used when every ordering column is a concrete,
+non nullable field (NULLs have backend dependent ordering and can't be
+compared with < or >).
+'''
+import base64
+import datetime
+import decimal
+import time
+try:
+    from simplejson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
+from django.db.models import Q
+
+from adminextras.datatables.utils import resolve_lookup, LOOKUP_SEP
+
+def _cursor_value(value):
+    # unicode() of dates, datetimes and decimals is parsed back by the
+    # lookups without losing precision (microseconds, decimal places)
+    if isinstance(value, (datetime.date, datetime.time, decimal.Decimal)):
+        return unicode(value)
+    return value
+
+def encode_cursor(start, order_by, values, scope = None):
+    ''' Packs a cursor into an URL safe token '''
+    data = json_dumps([start, order_by, map(_cursor_value, values), scope])
+    return base64.urlsafe_b64encode(data)
+
+def decode_cursor(token):
+    '''
+    Unpacks a cursor token.
+    @return: (start, order_by, values, scope) or None if the token is garbage.
+    '''
+    try:
+        start, order_by, values, scope = json_loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(start, int) or len(order_by) != len(values):
+        return None
+    return start, order_by, values, scope
+
+
+def keyset_ordering(model, order_by_fields):
+    '''
+    Returns the ordering with the primary key appended as tie breaker, so
+    every row has a unique key, or None if the ordering can't be used for
+    keyset pagination.
+    '''
+    pk_name = model._meta.pk.name
+    ordering = list(order_by_fields)
+    for field_name in ordering:
+        path = resolve_lookup(model, field_name.lstrip('-'))
+        if not path:
+            return None
+        for field, _model, direct, m2m in path:
+            if not direct or m2m or field.null:
+                return None
+        if getattr(path[-1][0], 'rel', None):
+            # Ordering by a FK uses the related model Meta.ordering
+            return None
+    if not filter(lambda f: f.lstrip('-') in ('pk', pk_name), ordering):
+        ordering.append('pk')
+    return ordering
+
+def keyset_filter(ordering, values):
+    '''
+    Builds the Q object that selects the rows after the given key::
+
+        (a > va) | (a = va & b > vb) | (a = va & b = vb & pk > vpk)
+    '''
+    query = None
+    for n, field_name in enumerate(ordering):
+        name = field_name.lstrip('-')
+        op = field_name.startswith('-') and 'lt' or 'gt'
+        condition = Q(**{str('%s__%s' % (name, op)): values[n]})
+        for prev_name, prev_value in zip(ordering[:n], values[:n]):
+            condition &= Q(**{str(prev_name.lstrip('-')): prev_value})
+        query = condition if query is None else query | condition
+    return query
+
+def row_key(instance, ordering):
+    ''' Reads the ordering values from an instance or a values() row '''
+    values = []
+    for field_name in ordering:
+        if isinstance(instance, dict):
+            values.append(instance[field_name.lstrip('-')])
+            continue
+        value = instance
+        for name in field_name.lstrip('-').split(LOOKUP_SEP):
+            value = getattr(value, name)
+        values.append(value)
+    return values
+
+
+def page_queryset(queryset, ordering, start, length, cursor = None, scope = None):
+    '''
+    The unevaluated page of the queryset, seeking on the cursor if it's valid
+    for this ordering, start position and scope, using OFFSET otherwise.
+    @param ordering: The output of keyset_ordering
+    @param scope: Identifies the filters applied to the queryset
+    '''
+    queryset = queryset.order_by(*ordering)
+    cursor = cursor and decode_cursor(cursor)
+    if cursor and cursor[0] == start and cursor[1] == ordering and cursor[3] == scope:
+        return queryset.filter(keyset_filter(ordering, cursor[2]))[:length]
+    return queryset[start:start + length]
+
+def next_cursor(ordering, start, length, rows, last_row, scope = None):
+    '''
+    The cursor of the page after the one that had rows rows, the last one
+    being last_row. None if that was the last page.
+    '''
+    if rows != length:
+        return None
+    return encode_cursor(start + length, ordering, row_key(last_row, ordering), scope)
+
+def paginate(queryset, ordering, start, length, cursor = None, scope = None):
+    '''
+    Gets a page of the queryset (see page_queryset).
+    @return: (page, next_cursor_token)
+    '''
+    page = list(page_queryset(queryset, ordering, start, length, cursor, scope))
+    return page, next_cursor(ordering, start, length, len(page),
+                             page and page[-1], scope)
+
+def iterate_keyset(queryset, ordering, chunk_size, on_chunk = None, key = None):
+    '''
+    Iterates the whole queryset in chunks of chunk_size rows, each one
+    fetched seeking after the last row of the previous one, so only a chunk
+    is in memory and no OFFSET is walked.
+    @param ordering: The output of keyset_ordering. With values() querysets
+    the ordering fields have to be among the values.
+    @param on_chunk: Called with the rows and the seconds taken by the query
+    of each chunk
+    @param key: Reads the ordering values of a row, for values_list()
+    querysets (row_key by default)
+    '''
+    queryset = queryset.order_by(*ordering)
+    chunk = _fetch(queryset[:chunk_size], on_chunk)
+    while chunk:
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            break
+        if key is None:
+            values = row_key(chunk[-1], ordering)
+        else:
+            values = key(chunk[-1])
+        after = keyset_filter(ordering, values)
+        chunk = _fetch(queryset.filter(after)[:chunk_size], on_chunk)
+
+def _fetch(queryset, on_chunk):
+    if on_chunk is None:
+        return list(queryset)
+    begin = time.time()
+    chunk = list(queryset)
+    on_chunk(len(chunk), time.time() - begin)
+    return chunk
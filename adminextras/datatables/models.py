@@ -0,0 +1,3 @@
+# The signals that bump the model generations are connected on import, see
+# datatables.cache
+import adminextras.datatables.cache
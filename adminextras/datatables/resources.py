@@ -0,0 +1,253 @@
+# encoding: utf-8
+'''
+Datatable resources.
+
+The models a datatable can list (its sResource) have to be registered, the
+same way they are registered in the admin. Applications declare them in a
+datatables.py module, which autodiscover() imports::
+
+    from adminextras.datatables.resources import registry
+    from ventas.models import Factura
+
+    registry.register(Factura,
+        columns = ('numero', 'fecha', 'cliente.nombre', 'total'),
+        ordering = ('-fecha', ),
+        search_fields = ('^cliente__nombre', '=numero'),
+        count_strategy = 'estimated',
+    )
+
+count_strategy (see datatables.counting) is used by both list/ and count/,
+unless the view is given one. Only the declared columns can be requested. They default to the fields of
+the model, dotted paths and methods have to be listed. Everything that can
+be worked out from the model (which columns are fields, which can be sorted,
+the relations to select_related) is done at registration, so serving a
+request only takes a dict lookup.
+
+Resources can be backed by the ModelAdmin of an admin site, so its
+queryset(request) (and its row level restrictions), its permissions and its
+list_display/search_fields/ordering are used::
+
+    registry.register(Factura, admin_site = 'admin')
+
+A model that isn't registered but is registered in some CustomAdminSite is
+served through its ModelAdmin. Permission checks are remembered for the rest
+of the request and, for DATATABLE_PERMISSION_CACHE_TIMEOUT seconds, for the
+user (until users, groups or permissions change). Set it to 0 if some
+has_view_permission depends on more than the user.
+
+DATATABLE_AUTO_RESOURCES = True registers any model the first time it's
+requested, as sResource used to work, with its fields as columns.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.contrib.auth.models import User, Group, Permission
+from django.db.models.loading import get_model
+from django.utils.importlib import import_module
+from django.utils.module_loading import module_has_submodule
+
+from adminextras.datatables.exceptions import (InvalidColumn, InvalidModel,
+    ResourceNotFound)
+from adminextras.datatables.search import SearchEngine
+from adminextras.datatables.cache import get_generations
+from adminextras.datatables.utils import (resolve_lookup, is_value_path,
+    is_forward_path, plan_relations, LOOKUP_SEP)
+
+DATATABLE_AUTO_RESOURCES = getattr(settings, 'DATATABLE_AUTO_RESOURCES', False)
+DATATABLE_PERMISSION_CACHE_TIMEOUT = getattr(settings, 'DATATABLE_PERMISSION_CACHE_TIMEOUT', 60)
+
+PERMISSION_KEY = 'adminextras.datatables.permission.%s.%s.%s.%s'
+
+class ColumnInfo(object):
+    '''
+    What's known about a column of a resource
+    '''
+    def __init__(self, model, name):
+        self.name = name
+        self.lookup = name.replace('.', LOOKUP_SEP)
+        path = resolve_lookup(model, self.lookup)
+        # values() lookup, None if the column needs instances
+        self.value_lookup = is_value_path(path) and self.lookup or None
+        self.sortable = is_forward_path(path)
+        self.select_related, self.prefetch_related = plan_relations(model, [name])
+
+
+class DataTableResource(object):
+    '''
+    A model listed by jq_datatable. Subclasses can override get_queryset
+    to restrict the rows.
+    '''
+    def __init__(self, model, columns = None, ordering = (), search_fields = None,
+                 name = None, count_strategy = None):
+        opts = model._meta
+        self.model = model
+        self.name = name or '%s.%s' % (opts.app_label, opts.object_name)
+        if columns is None:
+            columns = [field.name for field in opts.fields]
+        self.columns = dict((column, ColumnInfo(model, column)) for column in columns)
+        self.ordering = tuple(ordering)
+        self.search_engine = SearchEngine(model, search_fields)
+        # None for DATATABLE_COUNT_STRATEGY
+        self.count_strategy = count_strategy
+
+    def __repr__(self):
+        return '<DataTableResource %s>' % self.name
+
+    def get_queryset(self, request = None):
+        return self.model._default_manager.all()
+
+    def check_columns(self, columns):
+        for column in columns:
+            if not column in self.columns:
+                raise InvalidColumn(u"%s is not a column of %s" % (column, self.name))
+
+    def column_lookups(self, columns):
+        return [self.columns[column].value_lookup for column in columns]
+
+    def is_sortable(self, column):
+        info = self.columns.get(column)
+        return info is not None and info.sortable
+
+    def plan_relations(self, columns):
+        ''' Same as utils.plan_relations, from the precomputed plans '''
+        select_related, prefetch_related = set(), set()
+        for column in columns:
+            select_related.update(self.columns[column].select_related)
+            prefetch_related.update(self.columns[column].prefetch_related)
+        return sorted(select_related), sorted(prefetch_related)
+
+
+class ModelAdminResource(DataTableResource):
+    '''
+    A resource listed through a ModelAdmin. The options default to the
+    ModelAdmin ones.
+    '''
+    def __init__(self, model_admin, columns = None, ordering = None,
+                 search_fields = None, name = None, count_strategy = None):
+        self.model_admin = model_admin
+        model = model_admin.model
+        if columns is None:
+            columns = [field.name for field in model._meta.fields]
+            for name_ in model_admin.list_display:
+                if isinstance(name_, basestring) and hasattr(model, name_) \
+                        and not name_ in columns:
+                    columns.append(name_)
+        if ordering is None:
+            ordering = model_admin.ordering or ()
+        if search_fields is None:
+            search_fields = model_admin.search_fields
+        super(ModelAdminResource, self).__init__(model, columns, ordering,
+                                                 search_fields, name, count_strategy)
+
+    def __repr__(self):
+        return '<ModelAdminResource %s of %s>' % (self.name,
+                                                  self.model_admin.admin_site.name)
+
+    def has_permission(self, request):
+        model_admin = self.model_admin
+        # CustomModelAdmin knows about view permissions
+        has_view_permission = getattr(model_admin, 'has_view_permission',
+                                      model_admin.has_change_permission)
+        return has_view_permission(request)
+
+    def check_permission(self, request):
+        '''
+        @raise PermissionDenied: If the user can't see the model
+        '''
+        if request is None:
+            raise PermissionDenied(u"Not allowed to list %s" % self.name)
+        memo = request.__dict__.setdefault('_datatable_permissions', {})
+        key = id(self)
+        if not key in memo:
+            memo[key] = self._cached_permission(request)
+        if not memo[key]:
+            raise PermissionDenied(u"Not allowed to list %s" % self.name)
+
+    def _cached_permission(self, request):
+        user = getattr(request, 'user', None)
+        if not DATATABLE_PERMISSION_CACHE_TIMEOUT or not user or not user.is_authenticated():
+            return self.has_permission(request)
+        key = PERMISSION_KEY % (self.model_admin.admin_site.name, self.name,
+                                user.id, '.'.join(map(str, get_generations(
+                                                    [User, Group, Permission]))))
+        allowed = cache.get(key)
+        if allowed is None:
+            allowed = self.has_permission(request)
+            cache.set(key, allowed, DATATABLE_PERMISSION_CACHE_TIMEOUT)
+        return allowed
+
+    def get_queryset(self, request = None):
+        self.check_permission(request)
+        return self.model_admin.queryset(request)
+
+
+def _get_admin_site(admin_site):
+    from adminextras.admin.modeladmin import CustomAdminSite
+    if isinstance(admin_site, basestring):
+        return CustomAdminSite.instances[admin_site]
+    return admin_site
+
+
+class DataTableRegistry(object):
+    def __init__(self):
+        self._resources = {}
+
+    def register(self, model_or_resource, admin_site = None, **options):
+        '''
+        Registers a DataTableResource, or a model with the DataTableResource
+        options (columns, ordering, search_fields, name, count_strategy).
+        @param admin_site: A CustomAdminSite or its name, the model is listed
+        through its ModelAdmin
+        '''
+        if isinstance(model_or_resource, DataTableResource):
+            resource = model_or_resource
+        elif admin_site is not None:
+            model_admin = _get_admin_site(admin_site)._registry[model_or_resource]
+            resource = ModelAdminResource(model_admin, **options)
+        else:
+            resource = DataTableResource(model_or_resource, **options)
+        self._resources[resource.name.lower()] = resource
+        return resource
+
+    def unregister(self, name):
+        self._resources.pop(name.lower(), None)
+
+    def get(self, name):
+        '''
+        @raise ResourceNotFound: If nothing is registered under that name
+        '''
+        if not name:
+            raise InvalidModel(u"Missing sResource argument.")
+        try:
+            return self._resources[name.lower()]
+        except KeyError:
+            pass
+        model = name.count('.') == 1 and get_model(*name.split('.'))
+        if model:
+            from adminextras.admin.modeladmin import CustomAdminSite
+            for site in CustomAdminSite.instances.values():
+                if model in site._registry:
+                    return self.register(model, admin_site = site, name = name)
+            if DATATABLE_AUTO_RESOURCES:
+                return self.register(model, name = name)
+        raise ResourceNotFound("%s did not match any resource" % name)
+
+    def __contains__(self, name):
+        return name.lower() in self._resources
+
+registry = DataTableRegistry()
+
+
+def autodiscover():
+    '''
+    Imports the datatables module of every installed application, like
+    admin.autodiscover does with admin modules.
+    '''
+    for app in settings.INSTALLED_APPS:
+        mod = import_module(app)
+        try:
+            import_module('%s.datatables' % app)
+        except:
+            # Don't hide the errors of existing modules
+            if module_has_submodule(mod, 'datatables'):
+                raise
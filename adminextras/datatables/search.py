@@ -0,0 +1,230 @@
+# encoding: utf-8
+'''
+Server side search for jq_datatable (sSearch, sSearch_N, bRegex, bRegex_N,
+bSearchable_N).
+
+The global search is split in words, every word has to match some searchable
+column. istartswith and iexact columns are matched against the whole term as
+well, a word after the first can't be a prefix of them. Column searches
+(sSearch_N) are ANDed to it. The lookup used for each column is picked from
+the field:
+
+    * text fields with an index (db_index, unique): istartswith, which a
+      prefix index can serve, icontains otherwise.
+    * numbers and dates: exact match when the term parses, the column is
+      skipped otherwise.
+    * bRegex: iregex.
+
+DATATABLE_SEARCH_FIELDS overrides the choice per model, with the same
+prefixes as ModelAdmin.search_fields::
+
+    DATATABLE_SEARCH_FIELDS = {
+        'ventas.factura': ('^cliente__nombre', '=numero', '@notas'),
+    }
+
+'^' is istartswith, '=' iexact, '$' icontains and '@' full text search:
+
+    * PostgreSQL: to_tsvector(DATATABLE_SEARCH_TS_CONFIG, column) @@
+      plainto_tsquery(...), a GIN index on the same expression serves it.
+    * SQLite: a FTS5 table named <db_table>_fts whose rowid is the pk and
+      with the searched columns, for instance::
+
+          CREATE VIRTUAL TABLE ventas_factura_fts USING fts5(notas,
+              content='ventas_factura', content_rowid='id');
+
+      (plus the triggers that keep it up to date, see the SQLite docs).
+    * Other backends: icontains.
+'''
+import datetime
+import decimal
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q, fields
+
+from adminextras.datatables.utils import resolve_lookup, is_value_path, LOOKUP_SEP
+
+DATATABLE_SEARCH_FIELDS = getattr(settings, 'DATATABLE_SEARCH_FIELDS', {})
+DATATABLE_SEARCH_TS_CONFIG = getattr(settings, 'DATATABLE_SEARCH_TS_CONFIG', 'simple')
+
+DATE_FORMAT = settings.DATE_INPUT_FORMATS[0] or '%d/%m/%Y'
+
+SEARCH_PREFIXES = {
+    '^': 'istartswith',
+    '=': 'iexact',
+    '$': 'icontains',
+    '@': 'fulltext',
+}
+
+INTEGER_FIELDS = (fields.IntegerField, fields.AutoField)
+DECIMAL_FIELDS = (fields.DecimalField, fields.FloatField)
+
+def _parse_term(field, term):
+    '''
+    Converts the term to the field type for exact lookups.
+    @raise ValueError: If it doesn't parse
+    '''
+    if isinstance(field, INTEGER_FIELDS):
+        return int(term)
+    elif isinstance(field, DECIMAL_FIELDS):
+        try:
+            return decimal.Decimal(term)
+        except decimal.InvalidOperation:
+            raise ValueError(term)
+    elif isinstance(field, fields.DateField):
+        # DateTimeField is a DateField too, search the whole day
+        return datetime.datetime.strptime(term, DATE_FORMAT).date()
+    raise ValueError(term)
+
+
+def _and(query, other):
+    return other if query is None else query & other
+
+def _or(query, other):
+    return other if query is None else query | other
+
+
+class SearchEngine(object):
+    '''
+    Builds the search Q objects of a model datatable.
+    '''
+    def __init__(self, model, search_fields = None):
+        self.model = model
+        if search_fields is None:
+            opts = model._meta
+            label = '%s.%s' % (opts.app_label, opts.object_name.lower())
+            search_fields = DATATABLE_SEARCH_FIELDS.get(label, ())
+        # lookup -> lookup type
+        self.search_fields = {}
+        for name in search_fields:
+            lookup_type = SEARCH_PREFIXES.get(name[0])
+            if lookup_type:
+                name = name[1:]
+            self.search_fields[name] = lookup_type
+
+    def lookup_type(self, lookup, field):
+        ''' How a column is searched, None if it can't be '''
+        lookup_type = self.search_fields.get(lookup)
+        if lookup_type:
+            return lookup_type
+        if isinstance(field, fields.BooleanField):
+            return None
+        elif isinstance(field, INTEGER_FIELDS + DECIMAL_FIELDS + (fields.DateField, )):
+            return 'exact'
+        elif isinstance(field, (fields.CharField, fields.TextField)):
+            if field.db_index or field.unique:
+                return 'istartswith'
+            return 'icontains'
+        return None
+
+    def column_lookup_type(self, lookup):
+        ''' lookup_type of a column lookup, None for methods, relations... '''
+        path = resolve_lookup(self.model, lookup)
+        if not is_value_path(path):
+            return None
+        return self.lookup_type(lookup, path[-1][0])
+
+    def term_query(self, lookup, term, regex = False):
+        '''
+        Q object matching the term on the column lookup, None if the column
+        can't be searched for this term.
+        '''
+        path = resolve_lookup(self.model, lookup)
+        if not is_value_path(path):
+            # Methods, relations...
+            return None
+        field = path[-1][0]
+        lookup_type = self.lookup_type(lookup, field)
+        if lookup_type is None:
+            return None
+        if regex:
+            if lookup_type == 'exact':
+                return None
+            lookup_type = 'iregex'
+        if lookup_type == 'fulltext':
+            return self.fulltext_query(lookup, path, term)
+        if lookup_type == 'exact':
+            try:
+                term = _parse_term(field, term)
+            except ValueError:
+                return None
+            if isinstance(field, fields.DateTimeField):
+                # The whole day
+                lookup_type = 'range'
+                term = (datetime.datetime.combine(term, datetime.time.min),
+                        datetime.datetime.combine(term, datetime.time.max))
+        return Q(**{str('%s__%s' % (lookup, lookup_type)): term})
+
+    def fulltext_query(self, lookup, path, term):
+        field, model = path[-1][0], path[-1][1]
+        connection = connections[model._default_manager.db]
+        quote_name = connection.ops.quote_name
+        # The condition goes in a single table subquery, which gets an alias:
+        # columns are not qualified
+        if connection.vendor == 'postgresql':
+            where = "to_tsvector(%%s, %s) @@ plainto_tsquery(%%s, %%s)" % (
+                        quote_name(field.column))
+            params = [DATATABLE_SEARCH_TS_CONFIG, DATATABLE_SEARCH_TS_CONFIG, term]
+        elif connection.vendor == 'sqlite':
+            fts_table = quote_name('%s_fts' % model._meta.db_table)
+            where = "%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" % (
+                        quote_name(model._meta.pk.column), fts_table, fts_table)
+            params = ['%s : "%s"' % (field.column, term.replace('"', '""'))]
+        else:
+            return Q(**{str('%s__icontains' % lookup): term})
+        matching = model._default_manager.extra(where = [where], params = params)
+        # Through the relation the column was reached by
+        relation = LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1] + ['pk'])
+        return Q(**{str('%s__in' % relation): matching.values('pk')})
+
+    def search_query(self, dt_request):
+        '''
+        Combines the global and the column searches of a DataTableRequest.
+        @return: A Q object or None if there's nothing to search
+        '''
+        columns = []
+        for n, name in enumerate(dt_request.columns):
+            if dt_request.get('bSearchable_%d' % n, True):
+                columns.append((n, name.replace('.', LOOKUP_SEP)))
+
+        query = None
+        term = dt_request.get('sSearch', u'').strip()
+        if term:
+            regex = dt_request.get('bRegex', False)
+            words = regex and [term] or term.split()
+            # Every word must match some column
+            for word in words:
+                word_query = None
+                for n, lookup in columns:
+                    column_query = self.term_query(lookup, word, regex)
+                    if column_query is not None:
+                        word_query = _or(word_query, column_query)
+                if word_query is None:
+                    # Nothing can match it
+                    word_query = Q(pk__in = [])
+                query = _and(query, word_query)
+            if len(words) > 1:
+                # Or the whole term is the prefix (or the value) of a column
+                for n, lookup in columns:
+                    if self.column_lookup_type(lookup) in ('istartswith', 'iexact'):
+                        query = _or(query, self.term_query(lookup, term))
+
+        for n, lookup in columns:
+            term = dt_request.get('sSearch_%d' % n, u'').strip()
+            if not term:
+                continue
+            column_query = self.term_query(lookup, term,
+                                           dt_request.get('bRegex_%d' % n, False))
+            if column_query is None:
+                column_query = Q(pk__in = [])
+            query = _and(query, column_query)
+        return query
+
+    def search(self, queryset, dt_request):
+        '''
+        @return: (queryset, searched), searched tells whether the queryset
+        was filtered at all.
+        '''
+        query = self.search_query(dt_request)
+        if query is None:
+            return queryset, False
+        return queryset.filter(query), True
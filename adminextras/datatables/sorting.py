@@ -0,0 +1,147 @@
+# encoding: utf-8
+'''
+Sort index advisor: tells the orderings the database can read from an index
+from the ones that make it sort the whole table.
+
+The indexes of a model are worked out once from its metadata: the primary
+key, unique and db_index fields, foreign keys and unique_together. Indexes
+created by hand (custom SQL, migrations) are declared in
+DATATABLE_SORT_INDEXES::
+
+    DATATABLE_SORT_INDEXES = {
+        'ventas.Factura': [('fecha', 'numero'), ('total', )],
+    }
+
+An ordering is indexed when its fields are the leading fields of an index
+of the model, all in the same direction (a trailing primary key, the keyset
+tie breaker, doesn't count). Fields of related models and random ordering
+never are.
+
+Unindexed orderings of tables with DATATABLE_SORT_WARN_ROWS rows or more
+(by the database statistics, see counting.estimate_rows, or the cached
+count) are logged as warnings to the adminextras.datatables.sorting logger.
+Past DATATABLE_SORT_LIMIT_ROWS rows, DATATABLE_UNINDEXED_SORT decides:
+
+    * 'allow': they are sorted anyway.
+    * 'downgrade': the ordering is cut down to its indexed leading fields,
+      or replaced by the default one if there are none.
+    * 'refuse': UnindexedSort is raised.
+'''
+import logging
+from django.conf import settings
+from django.db.models import ForeignKey
+
+from adminextras.datatables.counting import estimate_rows, CachedCount
+from adminextras.datatables.exceptions import UnindexedSort
+from adminextras.datatables.utils import LOOKUP_SEP
+
+DATATABLE_SORT_INDEXES = getattr(settings, 'DATATABLE_SORT_INDEXES', {})
+DATATABLE_SORT_WARN_ROWS = getattr(settings, 'DATATABLE_SORT_WARN_ROWS', 100000)
+DATATABLE_SORT_LIMIT_ROWS = getattr(settings, 'DATATABLE_SORT_LIMIT_ROWS', 1000000)
+DATATABLE_UNINDEXED_SORT = getattr(settings, 'DATATABLE_UNINDEXED_SORT', 'allow')
+
+SORT_POLICIES = ('allow', 'downgrade', 'refuse')
+
+logger = logging.getLogger('adminextras.datatables.sorting')
+
+_indexes = {}
+
+def model_indexes(model):
+    '''
+    @return: The indexes of the model, as a set of tuples of field names
+    '''
+    if model in _indexes:
+        return _indexes[model]
+    opts = model._meta
+    indexes = set([(opts.pk.name, )])
+    for field in opts.local_fields:
+        if field.unique or field.db_index or isinstance(field, ForeignKey):
+            indexes.add((field.name, ))
+    for names in opts.unique_together:
+        indexes.add(tuple(names))
+    label = '%s.%s' % (opts.app_label, opts.object_name)
+    for names in DATATABLE_SORT_INDEXES.get(label, ()):
+        indexes.add(tuple(names))
+    _indexes[model] = indexes
+    return indexes
+
+def _sort_name(model, field):
+    ''' The field name of an order_by argument, None if it's not indexable '''
+    name = field.lstrip('-')
+    if name == '?' or LOOKUP_SEP in name:
+        return None
+    opts = model._meta
+    if name == 'pk':
+        return opts.pk.name
+    try:
+        model_field = opts.get_field(name)
+    except Exception:
+        return None
+    rel = getattr(model_field, 'rel', None)
+    if rel and rel.to._meta.ordering:
+        # Sorted by the ordering of the related model, through a join
+        return None
+    return name
+
+def indexed_prefix(model, order_by):
+    '''
+    @return: How many leading fields of order_by can be read from an index
+    '''
+    order_by = list(order_by)
+    keys = order_by
+    if len(keys) > 1 and keys[-1].lstrip('-') in ('pk', model._meta.pk.name):
+        # The tie breaker
+        keys = keys[:-1]
+    names = []
+    for field in keys:
+        name = _sort_name(model, field)
+        if name is None or field.startswith('-') != keys[0].startswith('-'):
+            break
+        names.append(name)
+    best = 0
+    for index in model_indexes(model):
+        n = 0
+        while n < len(names) and n < len(index) and names[n] == index[n]:
+            n += 1
+        best = max(best, n)
+    if best == len(keys):
+        return len(order_by)
+    return best
+
+def is_indexed(model, order_by):
+    order_by = list(order_by)
+    return not order_by or indexed_prefix(model, order_by) >= len(order_by)
+
+def table_rows(model):
+    ''' Rows of the model table, estimated when the database knows them '''
+    queryset = model._default_manager.all()
+    rows = estimate_rows(queryset)
+    if rows is None:
+        rows = CachedCount().count(queryset)
+    return rows
+
+def check_ordering(model, order_by, default = (), policy = None):
+    '''
+    Checks an ordering requested by the user.
+    @param default: The ordering used when a downgraded one is left empty
+    @param policy: One of SORT_POLICIES, DATATABLE_UNINDEXED_SORT by default
+    @return: The ordering to use
+    @raise UnindexedSort: If it's refused
+    '''
+    order_by = list(order_by)
+    if is_indexed(model, order_by):
+        return order_by
+    policy = policy or DATATABLE_UNINDEXED_SORT
+    if not DATATABLE_SORT_WARN_ROWS and (policy == 'allow' or not DATATABLE_SORT_LIMIT_ROWS):
+        return order_by
+    rows = table_rows(model)
+    opts = model._meta
+    if DATATABLE_SORT_WARN_ROWS and rows >= DATATABLE_SORT_WARN_ROWS:
+        logger.warning("Unindexed sort of %s.%s (%d rows) by %s",
+                       opts.app_label, opts.object_name, rows, ', '.join(order_by))
+    if policy == 'allow' or not DATATABLE_SORT_LIMIT_ROWS or rows < DATATABLE_SORT_LIMIT_ROWS:
+        return order_by
+    if policy == 'refuse':
+        raise UnindexedSort(u"Can't sort %s by %s, it has too many rows" %
+                            (opts.verbose_name_plural, ', '.join(order_by)))
+    return order_by[:indexed_prefix(model, order_by)] or list(default)
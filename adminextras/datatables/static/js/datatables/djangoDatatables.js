@@ -40,7 +40,8 @@ if (typeof(django) == 'undefined') {
 			 */
 			fnServerData: function ( sSource, aoData, fnCallback ) {
 				/* Add some extra data to the sender */
-				var oInitSettings = $(this).dataTable().fnSettings().oInit;
+				var oTable = $(this).dataTable();
+				var oInitSettings = oTable.fnSettings().oInit;
 				// debugger;
 				//console.error(oInitSettings);
 				if (typeof(oInitSettings.sResource) != 'undefined') {
@@ -48,13 +49,42 @@ if (typeof(django) == 'undefined') {
 					console.log("Adding resource: ", oInitSettings.sResource);
 					aoData.push( { name: "sResource", value: oInitSettings.sResource} );
 				}
+				if (oInitSettings.bKeyset) {
+					// Seek pagination, the server ignores stale cursors
+					aoData.push( { name: "bKeyset", value: true } );
+					if (oInitSettings.sNextCursor) {
+						aoData.push( { name: "sCursor", value: oInitSettings.sNextCursor } );
+					}
+				}
+				if (oInitSettings.bCompact) {
+					// Rows as arrays, the pks come apart in aPks
+					aoData.push( { name: "bCompact", value: true } );
+				}
+				
+				// sEcho changes the URL of every request, so the browser never
+				// revalidates: the ETag of the last response for the same
+				// arguments is sent here and a 304 reuses that response
+				var sKey = django.datatable.requestKey(oInitSettings.sBaseURL + 'list/', aoData);
+				var oCached = django.datatable.responses.get(sKey);
 				
 				// Substitute $.getJSON so we can see 500 error traceback
 				$.ajax({
 					url: oInitSettings.sBaseURL + 'list/',
 					dataType: 'json',
 					data: aoData,
-					success: function (json) {
+					beforeSend: function (xhr) {
+						if (oCached) {
+							xhr.setRequestHeader('If-None-Match', oCached.sETag);
+						}
+					},
+					success: function (json, textStatus, xhr) {
+	                    if (!json && oCached) {
+	                        // 304 Not Modified
+	                        json = $.extend({}, oCached.json);
+	                    }
+	                    else if (json && json.bSuccess && xhr && xhr.getResponseHeader('ETag')) {
+	                        django.datatable.responses.set(sKey, xhr.getResponseHeader('ETag'), json);
+	                    }
 	                    if (!json.bSuccess) {
 	                        console.error("Generando mensaje de error para", json);
 	                        var dialog = $('<div>' + json.sError + '<pre>' +
@@ -77,7 +107,19 @@ if (typeof(django) == 'undefined') {
 	                        $(dialog).dialog('show');
 	                    }
 	                    else {
+	                        oInitSettings.sNextCursor = json.sNextCursor || null;
+	                        oInitSettings.aPks = json.aPks || null;
+	                        // A reused response has the sEcho of the request it
+	                        // answered
+	                        $.each(aoData, function (i, oParam) {
+	                            if (oParam.name == 'sEcho') {
+	                                json.sEcho = oParam.value;
+	                            }
+	                        });
 	                        fnCallback(json)
+	                        if (json.bCountPending) {
+	                            django.datatable.fetchCount(oTable, oInitSettings.sBaseURL, aoData);
+	                        }
 	                    }
 					},
 					error: function (jqXHR, textStatus, errorThrown){
@@ -98,6 +140,16 @@ if (typeof(django) == 'undefined') {
 				
 				});
 			}, // fnServeData
+			/**
+			 * Compact rows have no DT_RowId, the row id is taken from aPks
+			 */
+			fnRowCallback: function (nRow, aData, iDisplayIndex) {
+				var aPks = $(this).dataTable().fnSettings().oInit.aPks;
+				if (aPks && typeof(aPks[iDisplayIndex]) != 'undefined') {
+					nRow.id = 'PK_' + aPks[iDisplayIndex];
+				}
+				return nRow;
+			},
 			createDialog: function () {
 				
 				alert("Hola");
@@ -106,6 +158,78 @@ if (typeof(django) == 'undefined') {
 			}
 		}
 	};
+	/**
+	 * The URL and arguments of a list request but sEcho, identify its response
+	 */
+	django.datatable.requestKey = function (sURL, aoData) {
+		return sURL + '?' + $.param($.grep(aoData, function (oParam) {
+			return oParam.name != 'sEcho';
+		}));
+	}
+	/**
+	 * The last responses of list requests with their ETag, by requestKey
+	 */
+	django.datatable.responses = {
+		iMax: 20,
+		aKeys: [],
+		oItems: {},
+		get: function (sKey) {
+			return this.oItems.hasOwnProperty(sKey) ? this.oItems[sKey] : null;
+		},
+		set: function (sKey, sETag, json) {
+			if (!this.oItems.hasOwnProperty(sKey)) {
+				this.aKeys.push(sKey);
+				if (this.aKeys.length > this.iMax) {
+					delete this.oItems[this.aKeys.shift()];
+				}
+			}
+			this.oItems[sKey] = { sETag: sETag, json: json };
+		}
+	};
+	/**
+	 * Lazy count: update the info and pager once the server has counted
+	 */
+	django.datatable.fetchCount = function (oTable, sBaseURL, aoData) {
+		$.ajax({
+			url: sBaseURL + 'count/',
+			dataType: 'json',
+			data: aoData,
+			success: function (json) {
+				var oSettings = oTable.fnSettings();
+				if (!json.bSuccess) {
+					console.error("No se pudo contar", json);
+					return;
+				}
+				oSettings._iRecordsTotal = json.iTotalRecords;
+				oSettings._iRecordsDisplay = json.iTotalDisplayRecords;
+				oSettings.oApi._fnUpdateInfo(oSettings);
+				$.fn.dataTableExt.oPagination[oSettings.sPaginationType].fnUpdate(oSettings, 
+					function (oSettings) {
+						oSettings.oApi._fnCalculateEnd(oSettings);
+						oSettings.oApi._fnDraw(oSettings);
+					});
+			}
+		});
+	}
+	/**
+	 * Several listings in one request: aRequests is a list of aoData (or
+	 * objects with the arguments), fnCallback gets the list of responses
+	 */
+	django.datatable.batch = function (sBaseURL, aRequests, fnCallback) {
+		$.ajax({
+			url: sBaseURL + 'batch/',
+			type: 'POST',
+			dataType: 'json',
+			data: { aoRequests: JSON.stringify(aRequests) },
+			success: function (json) {
+				if (!json.bSuccess) {
+					console.error("Error en el lote", json);
+					return;
+				}
+				fnCallback(json.aoResponses);
+			}
+		});
+	}
 	//
 	django.datatable._makeDateInputs = function (where) {
 		console.log("Creando date inputs en", where);
@@ -0,0 +1,136 @@
+# encoding: utf-8
+'''
+Streamed jq_datatable responses.
+
+Pages of DATATABLE_STREAM_ROWS rows or more are not built as a list of rows
+dumped with a single json_dumps. The rows are read with iterator(), encoded
+one by one and sent in chunks of DATATABLE_STREAM_CHUNK rows, so the memory
+a request takes doesn't grow with the page size.
+
+The response is the same JSON object, written in three parts::
+
+    {<head: sEcho, iTotalRecords...>, "aaData": [<rows>], <tail>}
+
+What is only known once the rows are read (sNextCursor, lazy counts) goes in
+the tail, and so do bSuccess and sError: if something fails halfway the
+array is closed and the tail carries the error.
+
+The rows are read while the response is sent, after the view returns, so
+middleware that reads response.content (GZip, ETags) makes it a normal
+response again.
+
+By then Django has sent request_finished, which closed the database
+connection: the first query of the rows opens a new one that nothing would
+close, left idle in a transaction on PostgreSQL. Streamed bodies are wrapped
+in closing_connection, which commits and closes it once the rows are read
+or the response is closed (unless a transaction is being managed, its owner
+ends it).
+'''
+try:
+    from simplejson import dumps as json_dumps
+except ImportError:
+    from json import dumps as json_dumps
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+DATATABLE_STREAM_ROWS = getattr(settings, 'DATATABLE_STREAM_ROWS', 1000)
+DATATABLE_STREAM_CHUNK = getattr(settings, 'DATATABLE_STREAM_CHUNK', 100)
+
+def should_stream(length, stream = None):
+    '''
+    @param stream: True or False to force it, None to decide on the page
+    length and DATATABLE_STREAM_ROWS (0 never streams)
+    '''
+    if stream is not None:
+        return stream
+    return bool(DATATABLE_STREAM_ROWS) and length >= DATATABLE_STREAM_ROWS
+
+
+def iterate(queryset, chunk_size = DATATABLE_STREAM_CHUNK):
+    '''
+    Iterates the queryset without keeping its results. The relations to
+    prefetch, which iterator() ignores, are fetched per chunk of rows.
+    '''
+    lookups = getattr(queryset, '_prefetch_related_lookups', None)
+    if not lookups:
+        for row in queryset.iterator():
+            yield row
+        return
+    # Django >= 1.4
+    from django.db.models.query import prefetch_related_objects
+    chunk = []
+    for row in queryset.iterator():
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            prefetch_related_objects(chunk, lookups)
+            for row in chunk:
+                yield row
+            chunk = []
+    if chunk:
+        prefetch_related_objects(chunk, lookups)
+        for row in chunk:
+            yield row
+
+
+def closing_connection(chunks, using = DEFAULT_DB_ALIAS):
+    '''
+    Yields the chunks of a streamed response, then commits and closes the
+    connection using (see the module docstring).
+    '''
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        connection = connections[using]
+        if not connection.is_managed():
+            connection.commit_unless_managed()
+            connection.close()
+
+
+class RowCounter(object):
+    '''
+    Iterates the rows remembering how many there were and the last one
+    '''
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.count = 0
+        self.last = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        row = self._rows.next()
+        self.count += 1
+        self.last = row
+        return row
+
+
+def json_stream(head, rows, tail, chunk_size = DATATABLE_STREAM_CHUNK):
+    '''
+    Yields the JSON of head + aaData + tail in chunks.
+    @param head: dict with the keys sent before the rows
+    @param rows: The jsonizable rows
+    @param tail: Callable that takes the exception that stopped the rows
+    (None if there was none) and returns the dict with the keys sent after
+    them. It's called within the except clause.
+    '''
+    data = json_dumps(head)[:-1]
+    yield data + (head and ', ' or '') + '"aaData": ['
+    separator = ''
+    encoded = []
+    try:
+        for row in rows:
+            encoded.append(json_dumps(row))
+            if len(encoded) == chunk_size:
+                yield separator + ', '.join(encoded)
+                separator, encoded = ', ', []
+        if encoded:
+            yield separator + ', '.join(encoded)
+        trailer = tail(None)
+    except Exception, e:
+        trailer = tail(e)
+    if trailer:
+        yield '], ' + json_dumps(trailer)[1:]
+    else:
+        yield ']}'
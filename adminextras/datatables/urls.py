@@ -1,8 +1,25 @@
 from django.conf.urls.defaults import patterns
 import views
+from resources import autodiscover
+from forms import warm_up, DATATABLE_FORMS_WARMUP
+
+# Resources declared in the datatables module of the applications
+autodiscover()
+if DATATABLE_FORMS_WARMUP:
+    warm_up(DATATABLE_FORMS_WARMUP is not True and DATATABLE_FORMS_WARMUP or None)
 urlpatterns = patterns('',
     # AJAX listings
     ('^list/?$', views.jq_datatable),
+    # Total records, when the count is lazy
+    ('^count/?$', views.jq_datatable_count),
+    # Every row, as CSV or XLSX
+    ('^export/?$', views.jq_datatable_export),
+    # Distinct values of a column
+    ('^values/?$', views.jq_datatable_values),
+    # Several listings in one request
+    ('^batch/?$', views.jq_datatable_batch),
+    # Response cache hits and misses
+    ('^cache/stats/?$', views.jq_datatable_cache_stats),
     
     # Returns the form HTML
     ('^forms?/?$', views.get_from), 
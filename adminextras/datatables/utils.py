@@ -0,0 +1,127 @@
+# encoding: utf-8
+'''
+Model introspection helpers shared by the datatable views.
+'''
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.fields.related import ManyToManyRel, OneToOneField
+
+LOOKUP_SEP = '__'
+
+def resolve_lookup(model, lookup):
+    '''
+    Walks a query lookup such as ``cliente__localidad__nombre`` through the
+    model metadata.
+    @return: A list of (field, model, direct, m2m) tuples, one per hop, as
+    returned by Options.get_field_by_name, or None if some part of the lookup
+    is not a model field (a method, a property, a typo...).
+    '''
+    path = []
+    for name in lookup.split(LOOKUP_SEP):
+        if model is None:
+            # Trying to go further than a plain field
+            return None
+        opts = model._meta
+        if name == 'pk':
+            name = opts.pk.name
+        try:
+            field, _model, direct, m2m = opts.get_field_by_name(name)
+        except FieldDoesNotExist:
+            return None
+        path.append((field, model, direct, m2m))
+        if direct and getattr(field, 'rel', None):
+            model = field.rel.to
+        elif not direct:
+            # Reverse relation (RelatedObject)
+            model = field.model
+        else:
+            model = None
+    return path
+
+def is_forward_path(path):
+    '''
+    True if the resolved lookup only goes through fields of the model and
+    foreign keys (no reverse nor m2m relations), so it's single valued.
+    '''
+    if not path:
+        return False
+    for field, _model, direct, m2m in path:
+        if not direct or m2m:
+            return False
+    return True
+
+def is_value_path(path):
+    '''
+    True if the resolved lookup ends in a plain field reached through forward
+    relations only, so it can be fetched with values() without instances.
+    '''
+    return is_forward_path(path) and not getattr(path[-1][0], 'rel', None)
+
+def _relation(model, name):
+    '''
+    Looks up an attribute name (not a query name, so reverse relations go by
+    their accessor, ``factura_set``) of a model.
+    @return: (related_model, multi_valued) or None if it's not a relation
+    '''
+    opts = model._meta
+    try:
+        field = opts.get_field(name)
+    except FieldDoesNotExist:
+        for related in (opts.get_all_related_objects() +
+                        opts.get_all_related_many_to_many_objects()):
+            if related.get_accessor_name() == name:
+                if isinstance(related.field, OneToOneField):
+                    # Reverse one to one, can't be select_related'ed
+                    return None
+                return related.model, True
+        return None
+    if not field.rel:
+        return None
+    return field.rel.to, isinstance(field.rel, ManyToManyRel)
+
+def plan_relations(model, columns):
+    '''
+    Works out the relations dotted columns (``cliente.localidad.nombre``)
+    walk, so they can be fetched with the page instead of one query per row
+    and hop.
+    @return: (select_related, prefetch_related) lookup lists. FK chains go to
+    select_related, paths through reverse or m2m relations to prefetch_related.
+    '''
+    select_related, prefetch_related = [], []
+    for column in columns:
+        current, path, first_multi = model, [], None
+        for name in column.split('.'):
+            relation = _relation(current, name)
+            if relation is None:
+                break
+            current, multi = relation
+            if multi and first_multi is None:
+                first_multi = len(path)
+            path.append(name)
+        if first_multi is None:
+            select_path = path
+        else:
+            select_path = path[:first_multi]
+            prefetch_related.append(LOOKUP_SEP.join(path))
+        if select_path:
+            select_related.append(LOOKUP_SEP.join(select_path))
+    return _longest_lookups(select_related), _longest_lookups(prefetch_related)
+
+def column_models(model, columns):
+    ''' The models dotted columns read, besides model itself '''
+    result = []
+    for column in columns:
+        current = model
+        for name in column.split('.'):
+            relation = _relation(current, name)
+            if relation is None:
+                break
+            current = relation[0]
+            if current not in result and current is not model:
+                result.append(current)
+    return result
+
+def _longest_lookups(lookups):
+    ''' Drops the lookups that are a prefix of another one (a in a__b) '''
+    lookups = set(lookups)
+    return sorted(filter(lambda l: not filter(lambda o: o.startswith(l + LOOKUP_SEP),
+                                              lookups), lookups))
@@ -1,49 +1,50 @@
 # encoding: utf-8
 
 from django.db import models
-from django.db.models.loading import get_model
+from django.db.models.query import ValuesQuerySet
 from django.conf import settings
 import datetime
+import hashlib
 try:
-    from simplejson import dumps as json_dumps
+    from simplejson import dumps as json_dumps, loads as json_loads
 except ImportError:
-    from json import dumps as json_dumps
-from django.http import HttpResponse
+    from json import dumps as json_dumps, loads as json_loads
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 import traceback
-from django.utils.encoding import smart_unicode
+from django.utils.encoding import smart_unicode, smart_str
 from django.template.loader import render_to_string
 from django.template.context import RequestContext
 from django.utils.safestring import mark_safe
+from django.utils.html import escape
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.csrf import csrf_exempt
+from adminextras.datatables.keyset import keyset_ordering, page_queryset, next_cursor
+from adminextras.datatables.streaming import (should_stream, iterate, RowCounter,
+    json_stream, closing_connection)
+from adminextras.datatables.coalesce import single_flight
+from adminextras.datatables.distinct import distinct_values
+from adminextras.datatables.forms import render_form
+from adminextras.datatables.export import (export_rows, csv_stream, xlsx_file,
+    EXPORT_FORMATS)
+from adminextras.admin.xlsx import iter_file, XLSX_MIMETYPE
+from adminextras.datatables.batch import (sub_request, run_batch,
+    run_in_background, DATATABLE_BATCH_MAX_REQUESTS)
+from adminextras.datatables.counting import get_count_strategy
+from adminextras.datatables.cache import (queryset_signature, get_response,
+    set_response, response_cache_stats, reset_response_cache_stats,
+    check_generations)
+from adminextras.datatables.search import SearchEngine
+from adminextras.datatables.sorting import check_ordering
+from adminextras.datatables.columns import (attribute_getter, compile_columns,
+    DATE_FORMAT)
+from adminextras.datatables.utils import (resolve_lookup, is_value_path, 
+    plan_relations, column_models, LOOKUP_SEP)
+from adminextras.datatables.exceptions import (DataTableArgumentsException,
+    InvalidColumn, InvalidModel, ResourceNotFound)
+from adminextras.datatables.resources import registry
 
-class DataTableArgumentsException(Exception):
-    pass
-
-class InvalidColumn(DataTableArgumentsException):
-    pass
-
-class InvalidModel(DataTableArgumentsException):
-    pass
-
-class ResourceNotFound(DataTableArgumentsException):
-    pass
-
-def _get_datatable_queryset(sResource):
-    '''
-    Gets the reousrce the datatable wants to list
-    It could be a model or an admin class
-    @return: A queryset
-    '''
-    # TODO: Get the queryset from an admin instance
-    if not sResource:
-        raise InvalidModel(u"Missing sResource argument.")
-    
-    app_name, model_name = sResource.split('.')
-    model = get_model(app_name, model_name)
-    if not model:
-        raise ResourceNotFound("%s did not match any resource" % sResource)
-    #import ipdb; ipdb.set_trace()
-    # Defaul manager
-    return model.objects
 
 
 def _debug_sorting_args(request):
@@ -63,25 +64,22 @@ class DataTableResponse(dict):
     def __getattr__(self, name):
         return self.__getitem__(name)
     
-DATE_FORMAT = settings.DATE_INPUT_FORMATS[0] or '%d/%m/%Y'
+# Fetch only the columns the client shows (see DataTableRequest.project_queryset)
+DATATABLE_PROJECTION = getattr(settings, 'DATATABLE_PROJECTION', False)
 
-def attribute_getter(instance, name):
-    '''
-    Callable called for conversion
-    '''
-    try:
-        data = getattr(instance, name)
-        if isinstance(data, (datetime.date,)):
-            return data.strftime(DATE_FORMAT)
-        elif isinstance(data, (models.Model, )):
-            #return [data.pk, unicode(data)]
-            return data
-        elif callable(data):
-            data = data()
-            
-    except AttributeError:
-        return "Not in model"
-    return data
+DEFAULT_ATTRIBUTE_GETTER = attribute_getter
+
+# Answer 304 Not Modified while the rows don't change (see _response_signature)
+DATATABLE_CONDITIONAL = getattr(settings, 'DATATABLE_CONDITIONAL', False)
+# Seconds the serialized responses are cached, 0 disables it
+DATATABLE_RESPONSE_CACHE_TIMEOUT = getattr(settings, 'DATATABLE_RESPONSE_CACHE_TIMEOUT', 0)
+# Share the response among concurrent identical requests (see datatables.coalesce)
+DATATABLE_COALESCE = getattr(settings, 'DATATABLE_COALESCE', False)
+# Seconds the prefetched next pages are kept, 0 disables prefetching
+DATATABLE_PREFETCH_TIMEOUT = getattr(settings, 'DATATABLE_PREFETCH_TIMEOUT', 0)
+
+# Arguments that change with every request but not the response
+VOLATILE_ARGUMENTS = ('sEcho', '_')
 
 class DataTableRequest(object):
     ''' 
@@ -94,9 +92,15 @@ class DataTableRequest(object):
             as a flat function).
     
     '''
+    # The registered resource being listed, if any (see datatables.resources)
+    resource = None
+    # The model listed, its sorts are checked against its indexes
+    model = None
+    
     def __init__(self, request):
         self._request = request.REQUEST # We don't care about GET/POST
         self._cache = {}
+        self.request = request
         
     def __getattr__(self, name): 
         if not name in self._cache:
@@ -117,6 +121,13 @@ class DataTableRequest(object):
         # s is the default case
         return data
     
+    def get(self, name, default = None):
+        ''' Like attribute access, but returns default for missing arguments '''
+        try:
+            return getattr(self, name)
+        except KeyError:
+            return default
+    
     def __str__(self):
         return "<DataTable Request Wrapper for %s>" % self._request
     
@@ -131,24 +142,38 @@ class DataTableRequest(object):
         return self._columns
     
     
+    @property
+    def search_signature(self):
+        ''' Identifies the global and column searches of the request '''
+        terms = [self.get('sSearch', u'')]
+        for n in range(len(self.columns)):
+            terms.append(self.get('sSearch_%d' % n, u''))
+        if not filter(None, terms):
+            return None
+        return u'\x00'.join(terms)
+    
     _order_by_fields = None
     @property
     def order_by_fields(self):
         '''
         Process request's iSort... fields into a valid QuerySet ordery_by(*fields)
         arguemnts. 
+        Sorts that no index backs are logged, downgraded or refused on big
+        tables (see datatables.sorting).
         '''
         
-        if not self._order_by_fields:
+        if self._order_by_fields is None:
             # Calculte order by fields
-            self._order_by_fields = []
+            fields = []
             
-            for n_col in range(self.iSortingCols):
+            for n_col in range(self.get('iSortingCols', 0)):
                 #col_number = int(request.REQUEST.get('iSortCol_%d' % i))
                 col_number = getattr(self, 'iSortCol_%d' % n_col)
                 
                 direction = getattr(self, 'sSortDir_%d' % n_col)
                 column = self.columns[col_number]
+                if self.resource and not self.resource.is_sortable(column):
+                    raise InvalidColumn(u"Can't sort by %s" % column)
                 column = column.replace('.', '__') # Query  lookups
                 if direction == u'asc':
                     pass 
@@ -156,30 +181,143 @@ class DataTableRequest(object):
                     column = '-%s' % column
                 else:
                     continue
-                self._order_by_fields.append(column)
+                fields.append(column)
+            
+            default = self.resource and list(self.resource.ordering) or []
+            if fields and self.model:
+                fields = check_ordering(self.model, fields, default)
+            self._order_by_fields = fields or default
         
         return self._order_by_fields
+    
+    def column_lookups(self, model):
+        '''
+        Maps every column to its query lookup (cliente.nombre -> cliente__nombre)
+        when it's a plain field reachable through forward relations, or to None
+        for methods, properties, relations and reverse or m2m paths.
+        '''
+        if self.resource:
+            return self.resource.column_lookups(self.columns)
+        lookups = []
+        for name in self.columns:
+            lookup = name.replace('.', LOOKUP_SEP)
+            if not is_value_path(resolve_lookup(model, lookup)):
+                lookup = None
+            lookups.append(lookup)
+        return lookups
+    
+    def project_queryset(self, queryset, extra_lookups = ()):
+        '''
+        Restricts the database columns fetched to the ones the client shows.
+        
+            * If every column is a field, rows are fetched with values() and
+              no model instance is created.
+            * Otherwise instances are fetched with only() the needed fields.
+              Methods must declare the fields they read as a datatable_fields
+              attribute (like short_description), for instance:
+              
+                  def total(self): return self.monto * self.cantidad
+                  total.datatable_fields = ('monto', 'cantidad')
+                  
+            * If some method doesn't declare them, everything but the TEXT
+              columns nobody asked for is fetched.
+        
+        @param extra_lookups: Lookups needed besides the columns (ordering)
+        '''
+        model = queryset.model
+        lookups = self.column_lookups(model)
+        if None not in lookups:
+            fields = ['pk']
+            for lookup in lookups + list(extra_lookups):
+                if lookup not in fields:
+                    fields.append(lookup)
+            return queryset.values(*fields)
+        
+        pk_name = model._meta.pk.name
+        needed = set()
+        for lookup in extra_lookups:
+            root = lookup.split(LOOKUP_SEP)[0]
+            needed.add(root == 'pk' and pk_name or root)
+        for name, lookup in zip(self.columns, lookups):
+            root = name.split('.')[0]
+            path = resolve_lookup(model, root)
+            if lookup or (path and path[0][2] and not path[0][3]):
+                # Related fields come with the relation
+                needed.add(root)
+                continue
+            depends = getattr(getattr(model, root, None), 'datatable_fields', None)
+            if depends is None:
+                text_fields = [f.name for f in model._meta.fields
+                               if isinstance(f, models.TextField)]
+                return queryset.defer(*[name for name in text_fields
+                                        if not name in needed])
+            needed.update(depends)
+        return queryset.only(*needed)
+    
+    def plan_related(self, queryset, result = None):
+        '''
+        Fetches the relations walked by dotted columns along with the page
+        (see utils.plan_relations). In DEBUG, the plan is sent to the client
+        as oQueryPlan.
+        '''
+        if self.resource:
+            select_related, prefetch_related = self.resource.plan_relations(self.columns)
+        else:
+            select_related, prefetch_related = plan_relations(queryset.model, self.columns)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related and hasattr(queryset, 'prefetch_related'):
+            # Django >= 1.4
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if result is not None and settings.DEBUG:
+            result.oQueryPlan = dict(select_related = select_related,
+                                     prefetch_related = prefetch_related)
+        return queryset
                 
         
                         
     def dump_queryset_data(self, queryset, pks_as_ids = True, row_class = None, 
                            attribute_getter = attribute_getter, 
-                           in_depth = True):
+                           in_depth = True, model = None):
         '''
         Converts a a model instance into a jsonizable dictionary.
-        
+        Unless a custom attribute_getter is given, columns are read with
+        accessors compiled once per model and column list (see 
+        datatables.columns).
+        @param model: The model of the rows, for querysets already evaluated
         '''
-        result = []
+        return list(self.iter_queryset_data(queryset, pks_as_ids, row_class,
+                                            attribute_getter, in_depth, model))
+    
+    def iter_queryset_data(self, queryset, pks_as_ids = True, row_class = None, 
+                           attribute_getter = attribute_getter, 
+                           in_depth = True, model = None):
+        '''
+        Like dump_queryset_data, yielding the rows one by one.
+        '''
+        compiled = in_depth and attribute_getter is DEFAULT_ATTRIBUTE_GETTER
+        accessors = None
+        if model is None:
+            model = getattr(queryset, 'model', None)
         for instance in queryset:
             row = {}
             # Row data
+            values_row = isinstance(instance, dict) # From project_queryset
             if pks_as_ids:
-                row.update(DT_RowId = 'PK_%s' % instance.pk)
+                pk = instance['pk'] if values_row else instance.pk
+                row.update(DT_RowId = 'PK_%s' % pk)
             if isinstance(row_class, basestring):
                 row.update(DT_RowClass = row_class)
             elif callable(row_class):
                 row.update(DT_RowClass = row_class(instance))
             # Row fields
+            if compiled or values_row:
+                if accessors is None:
+                    accessors = compile_columns(model, self.columns, values_row)
+                for number, accessor in enumerate(accessors):
+                    row[number] = accessor(instance)
+                yield row
+                continue
             for number, name in enumerate(self.columns):
                 # Get dot separated elements (depath search)
                 if in_depth:
@@ -189,17 +327,274 @@ class DataTableRequest(object):
                         data = attribute_getter(data, attr_name)
                     if isinstance(data, models.Model):
                         data = smart_unicode(data)
+                    elif isinstance(data, models.Manager):
+                        # Reverse FK and m2m columns (prefetched)
+                        data = u', '.join(map(smart_unicode, data.all()))
                     row[number] = data
                 else:
                     row[number] = attribute_getter(instance, name)
-            result.append(row)
-        return result
+            yield row
+    
+    def iter_queryset_arrays(self, queryset, pks, model = None):
+        '''
+        Rows for the compact format (bCompact): a list with the value of each
+        column. The primary keys are appended to pks, which goes in the
+        response as aPks instead of a DT_RowId per row.
+        @param pks: None not to collect them
+        @param model: The model of the rows, for querysets already evaluated
+        '''
+        if model is None:
+            model = getattr(queryset, 'model', None)
+        accessors = None
+        for instance in queryset:
+            values_row = isinstance(instance, dict)
+            if accessors is None:
+                accessors = compile_columns(model, self.columns, values_row)
+            if pks is not None:
+                pks.append(instance['pk'] if values_row else instance.pk)
+            yield [accessor(instance) for accessor in accessors]
+
+
+
+def _get_resource(dt_request, queryset = None):
+    '''
+    The queryset given to the view or the one of the registered resource
+    sResource names, whose columns are checked.
+    '''
+    if queryset is None:
+        dt_request.resource = registry.get(dt_request.get('sResource'))
+        dt_request.resource.check_columns(dt_request.columns)
+        queryset = dt_request.resource.get_queryset(dt_request.request)
+    dt_request.model = queryset.model
+    return queryset
+
+def _get_search_engine(dt_request, model):
+    if dt_request.resource:
+        return dt_request.resource.search_engine
+    return SearchEngine(model)
+
+def _get_count_strategy(dt_request, count_strategy = None):
+    ''' The one given to the view, or the one of the resource '''
+    if count_strategy is None and dt_request.resource:
+        count_strategy = dt_request.resource.count_strategy
+    return get_count_strategy(count_strategy)
+
+def _response_signature(dt_request, queryset):
+    '''
+    Identifies a jq_datatable response: the rows (the signature of the
+    searched queryset, with the generations of the models the columns read)
+    and the arguments. Needs no query. It's the response cache key, shared
+    by every user: the permission is checked before and what a user can see
+    is in the SQL of the queryset.
+    @return: The signature or None if it can't be worked out
+    '''
+    signature = queryset_signature(queryset, column_models(queryset.model,
+                                                           dt_request.columns))
+    if signature is None:
+        return None
+    request = dt_request.request
+    arguments = sorted((key, values) for key, values in
+                       request.GET.lists() + request.POST.lists()
+                       if not key in VOLATILE_ARGUMENTS)
+    return hashlib.md5(repr((signature, arguments))).hexdigest()
+
+def _response_etag(dt_request, signature):
+    ''' The ETag of the response with that signature, per user '''
+    user = getattr(dt_request.request, 'user', None)
+    return hashlib.md5(repr((signature, getattr(user, 'id', None)))).hexdigest()
+
+def _set_validator(response, etag):
+    response['ETag'] = quote_etag(etag)
+    # Browsers only, and always asking again
+    patch_cache_control(response, private = True, max_age = 0, must_revalidate = True)
+    patch_vary_headers(response, ('Cookie', ))
+    return response
+
+def _dumps_response(result):
+    '''
+    Serializes the response leaving sEcho out, so the body can be cached.
+    '''
+    result = dict(result)
+    result.pop('sEcho', None)
+    return json_dumps(result)
+
+def _with_echo(body, echo):
+    if echo is None:
+        return body
+    return '{"sEcho": %s, %s' % (json_dumps(echo), body[1:])
+
+def _set_error(result, error):
+    result.update(
+                  bSuccess = False,
+                  sError = unicode(error).encode('utf-8'),
+                  )
+    if settings.DEBUG:
+        result.update(sTraceback = traceback.format_exc())
+
+def _set_pending_count(result, start, length, rows):
+    '''
+    Enough for the pager to offer the next page, the client asks for the
+    real count to jq_datatable_count
+    '''
+    shown = start + rows
+    if rows == length:
+        shown += 1
+    result.iTotalRecords = result.iTotalDisplayRecords = shown
+    result.bCountPending = True
 
+def _page_queryset(result, dt_request, qs, searched_qs, searched, counter,
+                   projection, count = True):
+    '''
+    Counts the records and builds the queryset of the page.
+    @param count: False if result already has the counts
+    @return: (queryset, keyset ordering or None)
+    '''
+    start, length = dt_request.iDisplayStart, dt_request.iDisplayLength
+    # Return the client the amount of records available
+    if count and not counter.lazy:
+        result.iTotalRecords = result.iTotalDisplayRecords = counter.count(qs)
+        if searched:
+            result.iTotalDisplayRecords = counter.count(searched_qs)
+        if counter.estimated:
+            result.bCountEstimated = True
+    qs = searched_qs
+    
+    ordering = None
+    if dt_request.get('bKeyset', False):
+        ordering = keyset_ordering(qs.model, dt_request.order_by_fields)
+    if projection:
+        # The cursor needs the ordering values of the last row
+        qs = dt_request.project_queryset(qs, [f.lstrip('-') for f in ordering or ()])
+    if not isinstance(qs, ValuesQuerySet):
+        # values() rows already have the related columns joined
+        qs = dt_request.plan_related(qs, result)
+    if ordering:
+        # Page cost doesn't depend on how deep the page is
+        qs = page_queryset(qs, ordering, start, length, dt_request.get('sCursor'),
+                           dt_request.search_signature)
+    else:
+        qs = qs[start: start+length]
+    if dt_request.get('bCompact', False):
+        result.sColumns = dt_request.sColumns
+    return qs, ordering
 
+def _dump_page(result, dt_request, qs, model, ordering, counter):
+    ''' Fetches the page into result '''
+    start, length = dt_request.iDisplayStart, dt_request.iDisplayLength
+    page = list(qs)
+    if dt_request.get('bCompact', False):
+        result.aPks = []
+        result.aaData = list(dt_request.iter_queryset_arrays(page, result.aPks, model))
+    else:
+        result.aaData = dt_request.dump_queryset_data(page, pks_as_ids = True,
+                                                      model = model)
+    if ordering:
+        result.sNextCursor = next_cursor(ordering, start, length, len(page),
+                                         page and page[-1],
+                                         dt_request.search_signature)
+    
+    if counter.lazy:
+        _set_pending_count(result, start, length, len(page))
 
-def jq_datatable(request, queryset = None):
+def _prefetch_next_page(request, dt_request, result, qs, searched_qs, searched,
+                        counter, projection, timeout):
+    '''
+    Fetches the page after the one in result in the background and caches
+    its response for timeout seconds under the signature the request for
+    it will have, with the counts of this one.
+    '''
+    start, length = dt_request.iDisplayStart, dt_request.iDisplayLength
+    if len(result.aaData) < length:
+        # That was the last one
+        return
+    arguments = dict(request.GET.lists() + request.POST.lists())
+    arguments['iDisplayStart'] = [start + length]
+    if result.get('sNextCursor'):
+        arguments['sCursor'] = [result.sNextCursor]
+    next_request = DataTableRequest(sub_request(request, arguments))
+    next_request.resource = dt_request.resource
+    next_request.model = dt_request.model
+    signature = _response_signature(next_request, searched_qs)
+    if not signature or get_response(signature, count = False) is not None:
+        return
+    next_result = DataTableResponse(bSuccess = True, sError = '')
+    for key in ('iTotalRecords', 'iTotalDisplayRecords', 'bCountEstimated'):
+        if key in result:
+            next_result[key] = result[key]
+    def prefetch():
+        try:
+            page_qs, ordering = _page_queryset(next_result, next_request, qs,
+                                               searched_qs, searched, counter,
+                                               projection, count = False)
+            _dump_page(next_result, next_request, page_qs, qs.model, ordering,
+                       counter)
+            set_response(signature, _dumps_response(next_result), timeout)
+        except Exception:
+            # The request for the page will find out
+            pass
+    run_in_background(prefetch)
+
+def _stream_page(result, dt_request, queryset, model, ordering, counter,
+                 compact = False):
+    '''
+    Streamed response of the page (see datatables.streaming), what depends
+    on the rows is sent after them.
+    '''
+    start, length = dt_request.iDisplayStart, dt_request.iDisplayLength
+    page = RowCounter(iterate(queryset))
+    head = dict((key, value) for key, value in result.items()
+                if not key in ('bSuccess', 'sError'))
+    def tail(error):
+        trailer = DataTableResponse(bSuccess = True, sError = '')
+        if error is not None:
+            _set_error(trailer, error)
+            return trailer
+        if ordering:
+            trailer.sNextCursor = next_cursor(ordering, start, length, page.count,
+                                              page.last, dt_request.search_signature)
+        if counter.lazy:
+            _set_pending_count(trailer, start, length, page.count)
+        if compact:
+            trailer.aPks = pks
+        return trailer
+    if compact:
+        pks = []
+        rows = dt_request.iter_queryset_arrays(page, pks, model)
+    else:
+        rows = dt_request.iter_queryset_data(page, pks_as_ids = True, model = model)
+    return HttpResponse(closing_connection(json_stream(head, rows, tail), queryset.db))
+
+
+def jq_datatable(request, queryset = None, projection = DATATABLE_PROJECTION,
+                 count_strategy = None, stream = None,
+                 conditional = DATATABLE_CONDITIONAL,
+                 cache_timeout = DATATABLE_RESPONSE_CACHE_TIMEOUT,
+                 coalesce = DATATABLE_COALESCE,
+                 prefetch_timeout = DATATABLE_PREFETCH_TIMEOUT):
     '''
     Datatable JSON view generator
+    If projection is True only the columns in sColumns are fetched from the
+    database (see DataTableRequest.project_queryset).
+    count_strategy defaults to the one of the resource, DATATABLE_COUNT_STRATEGY
+    if it has none (see datatables.counting)
+    stream forces or disables streaming the rows, by default pages of
+    DATATABLE_STREAM_ROWS rows or more are streamed (see datatables.streaming)
+    If conditional is True responses carry an ETag and requests whose
+    If-None-Match matches get a 304 before counting or fetching anything.
+    It changes when the models of the queryset or of the dotted columns
+    are saved or deleted (see datatables.cache), but not when something
+    a method column reads does. It needs the generations in a cache shared
+    by every process, ImproperlyConfigured is raised if they can't change.
+    If cache_timeout is given, responses that aren't streamed are cached for
+    that many seconds under the same signature, so the cached ones are
+    dropped by any change of the data (see response_cache_stats).
+    If coalesce is True concurrent requests with the same signature in the
+    process share the response of the first one (see datatables.coalesce).
+    If prefetch_timeout is given, once a page is served the next one is
+    fetched in the background, with the same querysets and counts, and its
+    response is cached for that many seconds, so paging forward is served
+    from the cache. It needs a database that threads can share, not SQLite
+    (see datatables.batch).
     Some of the request parameteres are:
     
         sEcho, 
@@ -225,6 +620,13 @@ def jq_datatable(request, queryset = None):
         bSortable_1, 
         bSortable_2, 
         sMmodel: ...
+        bKeyset, (optional, seek pagination instead of OFFSET)
+        sCursor, (sNextCursor from the previous response, when bKeyset)
+        bCompact, (optional, rows as arrays, see below)
+    
+    With bCompact the rows of aaData are arrays of the column values, with
+    no DT_RowId. The primary keys come in aPks, in the same order, and the
+    columns once in sColumns.
     '''
     result = DataTableResponse(
                                # We expect it to succeed :)
@@ -232,6 +634,10 @@ def jq_datatable(request, queryset = None):
                                # So there won't be any error msg
                                sError = '',
             )
+    signature = etag = body = None
+    if conditional:
+        # A stale ETag would keep the client showing old rows for good
+        check_generations(kept = True)
     try:
         # Create the proxy for the DataTable Request
         dt_request = DataTableRequest(request)
@@ -240,11 +646,7 @@ def jq_datatable(request, queryset = None):
         result.sEcho = dt_request.sEcho
         
         
-        if not queryset:
-            # Get queryset
-            resource = _get_datatable_queryset(dt_request.sResource)
-        elif isinstance(object, models.query.QuerySet):
-            resource = queryset
+        resource = _get_resource(dt_request, queryset)
     
         # Tomar el inicio y el fin de la paginación
         start = dt_request.iDisplayStart
@@ -254,41 +656,213 @@ def jq_datatable(request, queryset = None):
         
         print "Sorting args: ", dt_request.order_by_fields
         qs = resource.order_by(*dt_request.order_by_fields)
-        # Return the client the amount of records available
-        result.iTotalRecords = result.iTotalDisplayRecords = qs.count()
+        searched_qs, searched = _get_search_engine(dt_request, qs.model).search(qs, dt_request)
+        streamed = should_stream(length, stream)
+        cached = cache_timeout or prefetch_timeout
+        if conditional or ((cached or coalesce) and not streamed):
+            signature = _response_signature(dt_request, searched_qs)
+        if conditional and signature:
+            etag = _response_etag(dt_request, signature)
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                return _set_validator(HttpResponseNotModified(), etag)
+        counter = _get_count_strategy(dt_request, count_strategy)
+        if cached and signature and not streamed:
+            body = get_response(signature)
+            if body is not None:
+                if prefetch_timeout:
+                    # Keep one page ahead
+                    _prefetch_next_page(request, dt_request,
+                                        DataTableResponse(json_loads(body)), qs,
+                                        searched_qs, searched, counter, projection,
+                                        prefetch_timeout)
+                response = HttpResponse(_with_echo(body, result.sEcho))
+                if etag:
+                    _set_validator(response, etag)
+                return response
+        if streamed:
+            qs, ordering = _page_queryset(result, dt_request, qs, searched_qs, searched,
+                                          counter, projection)
+            response = _stream_page(result, dt_request, qs, resource.model, ordering,
+                                    counter, dt_request.get('bCompact', False))
+            if etag:
+                _set_validator(response, etag)
+            return response
         
-        qs = qs[start: start+length]
-        
-        # Get data    
-        result.aaData = dt_request.dump_queryset_data(qs, pks_as_ids = True)
+        def render():
+            page_qs, ordering = _page_queryset(result, dt_request, qs, searched_qs, searched,
+                                               counter, projection)
+            _dump_page(result, dt_request, page_qs, resource.model, ordering, counter)
+            return _dumps_response(result)
+        if coalesce and signature:
+            # Identical requests in flight share the response
+            body = single_flight.do(signature, render)
+        else:
+            body = render()
+        if prefetch_timeout and 'aaData' in result:
+            # Only the request that rendered it knows the page
+            _prefetch_next_page(request, dt_request, result, qs, searched_qs,
+                                searched, counter, projection, prefetch_timeout)
     
     except Exception, e:
-        
-        result.update(
-                      bSuccess = False,
-                      sError = unicode(e).encode('utf-8'),
-                      )
-        if settings.DEBUG:
-            result.update(sTraceback = traceback.format_exc())
+        _set_error(result, e)
+        signature = etag = None
+        body = _dumps_response(result)
     #print "La respuesta es: ", pformat(result)
+    if cache_timeout and signature:
+        set_response(signature, body, cache_timeout)
+    response = HttpResponse(_with_echo(body, result.get('sEcho')))
+    if etag:
+        _set_validator(response, etag)
+    return response
+
+
+def jq_datatable_count(request, queryset = None, count_strategy = None):
+    '''
+    Counts the records of a datatable request, for the lazy count strategy.
+    Takes the same arguments as jq_datatable, the count_strategy given to
+    both has to be the same.
+    '''
+    result = DataTableResponse(bSuccess = True, sError = '')
+    try:
+        dt_request = DataTableRequest(request)
+        result.sEcho = dt_request.sEcho
+        qs = _get_resource(dt_request, queryset).all()
+        counter = _get_count_strategy(dt_request, count_strategy)
+        result.iTotalRecords = result.iTotalDisplayRecords = counter.count(qs)
+        searched_qs, searched = _get_search_engine(dt_request, qs.model).search(qs, dt_request)
+        if searched:
+            result.iTotalDisplayRecords = counter.count(searched_qs)
+        if counter.estimated:
+            result.bCountEstimated = True
+    except Exception, e:
+        _set_error(result, e)
+    return HttpResponse(json_dumps(result))
+
+
+def jq_datatable_values(request, queryset = None):
+    '''
+    Distinct values of the sColumn column of a datatable, for its filter
+    dropdown, with how many records have each one: aaValues is a list of
+    [value, count]. Columns with more than DATATABLE_VALUES_LIMIT values get
+    bTooManyValues instead (see datatables.distinct).
+    Takes sResource like jq_datatable.
+    '''
+    result = DataTableResponse(bSuccess = True, sError = '')
+    try:
+        dt_request = DataTableRequest(request)
+        column = result.sColumn = dt_request.sColumn
+        # The only column checked against the resource
+        dt_request._columns = [column]
+        qs = _get_resource(dt_request, queryset)
+        lookup = dt_request.column_lookups(qs.model)[0]
+        if lookup is None:
+            raise InvalidColumn(u"Can't list the values of %s" % column)
+        values = distinct_values(qs, column, lookup)
+        if values is None:
+            result.bTooManyValues = True
+            values = []
+        result.aaValues = values
+    except Exception, e:
+        _set_error(result, e)
+    return HttpResponse(json_dumps(result))
+
+
+def jq_datatable_export(request, queryset = None, projection = DATATABLE_PROJECTION):
+    '''
+    Exports every row of a datatable as it's shown (the sColumns, sorting
+    and search arguments of jq_datatable) as sFormat, csv (the default) or
+    xlsx. sTitles, comma separated, names the columns.
+    See datatables.export.
+    '''
+    result = DataTableResponse(bSuccess = True, sError = '')
+    try:
+        dt_request = DataTableRequest(request)
+        format = dt_request.get('sFormat', 'csv')
+        if not format in EXPORT_FORMATS:
+            raise DataTableArgumentsException(u"Unknown format %s" % format)
+        resource = _get_resource(dt_request, queryset)
+        qs = resource.order_by(*dt_request.order_by_fields)
+        qs, searched = _get_search_engine(dt_request, qs.model).search(qs, dt_request)
+        model = qs.model
+        ordering = keyset_ordering(model, dt_request.order_by_fields)
+        if projection:
+            qs = dt_request.project_queryset(qs, [f.lstrip('-') for f in ordering or ()])
+        if not isinstance(qs, ValuesQuerySet):
+            qs = dt_request.plan_related(qs)
+        header = dt_request.columns
+        if dt_request.get('sTitles'):
+            header = dt_request.sTitles.split(dt_request.COLUMN_SPLITTER)
+        rows = dt_request.iter_queryset_arrays(export_rows(qs, ordering), None, model)
+        name = getattr(dt_request.resource, 'name', None) or model._meta.object_name
+        if format == 'csv':
+            response = HttpResponse(closing_connection(csv_stream(header, rows), qs.db),
+                                    mimetype = 'text/csv')
+        else:
+            sheet_name = unicode(model._meta.verbose_name_plural)
+            response = HttpResponse(iter_file(xlsx_file(header, rows, sheet_name)),
+                                    mimetype = XLSX_MIMETYPE)
+        response['Content-Disposition'] = 'attachment; filename=%s.%s' % (
+                                                    smart_str(name), format)
+        return response
+    except Exception, e:
+        _set_error(result, e)
+    return HttpResponse(json_dumps(result))
+
+
+@csrf_exempt
+def jq_datatable_batch(request, count_strategy = None):
+    '''
+    Serves several jq_datatable requests in one, the aoRequests argument
+    is a JSON list with the arguments of each one (objects or DataTables
+    aoData lists). The responses come in aoResponses, in the same order.
+    They are run concurrently when the database allows it (see
+    datatables.batch). Nothing is written, so there's no CSRF check.
+    '''
+    result = DataTableResponse(bSuccess = True, sError = '')
+    try:
+        requests = json_loads(request.REQUEST.get('aoRequests', '[]'))
+        if not isinstance(requests, list):
+            raise DataTableArgumentsException(u"aoRequests must be a list")
+        if len(requests) > DATATABLE_BATCH_MAX_REQUESTS:
+            raise DataTableArgumentsException(u"More than %d requests" %
+                                              DATATABLE_BATCH_MAX_REQUESTS)
+        def serve(arguments):
+            return jq_datatable(sub_request(request, arguments),
+                                count_strategy = count_strategy,
+                                stream = False, conditional = False).content
+        bodies = run_batch(serve, requests)
+    except Exception, e:
+        _set_error(result, e)
+        return HttpResponse(json_dumps(result))
+    # The responses are already serialized
+    body = json_dumps(result)
+    return HttpResponse('%s, "aoResponses": [%s]}' % (body[:-1], ', '.join(bodies)))
+
+
+@staff_member_required
+def jq_datatable_cache_stats(request):
+    '''
+    Hit and miss counts of the response cache, reset with ?reset=1
+    '''
+    result = DataTableResponse(bSuccess = True, sError = '')
+    result.update(response_cache_stats())
+    if request.REQUEST.get('reset'):
+        reset_response_cache_stats()
     return HttpResponse(json_dumps(result))
 
 
 def get_from(request):
     # TODO: Better HTML
-    ''' Gets a form from request '''
+    '''
+    Gets a form from request, one of DATATABLE_FORMS (see datatables.forms)
+    '''
     form_name = request.REQUEST.get('form', None)
     if not form_name:
         return HttpResponse("Falta el form")
     try:
-        from_path, form_class = form_name.rsplit('.', 1)
-        m = __import__(from_path, {}, {}, '*')
-        Form = getattr(m, form_class)
-        form = Form()
-        
-    except (ImportError, AttributeError), e:
-        return HttpResponse("<h3>No se pudo encontrar el modulo %s</h3>" % form_name)
+        form_html = render_form(form_name)
+    except ImportError, e:
+        return HttpResponse("<h3>No se pudo encontrar el modulo %s</h3>" % escape(form_name))
     
-    form_html = render_to_string('datatables/forms/form.html', dict(form = form))
     return HttpResponse(mark_safe(form_html))
         
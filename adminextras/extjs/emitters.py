@@ -10,6 +10,8 @@ from django.utils import simplejson, datetime_safe
 from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.conf import settings
 from piston.emitters import Emitter
+from adminextras.datatables.sorting import check_ordering
+from adminextras.datatables.exceptions import UnindexedSort
 import datetime
 
 import logging
@@ -74,6 +76,8 @@ class SortingFilteringEmmiter(Emitter):
             limit -> int
             sort -> str
             dir -> ASC, DESC
+        Los ordenamientos sin índice en tablas grandes se controlan con
+        datatables.sorting (si se rechazan, el mensaje lo dice).
         '''
         message = 'OK'
         
@@ -104,7 +108,13 @@ class SortingFilteringEmmiter(Emitter):
         direction = request.REQUEST.get('dir', '')
         direction = direction == 'DESC' and '-' or ''
         if order_by:
-            self.data = self.data.order_by(direction + order_by)
+            try:
+                order_by = check_ordering(self.data.model, [direction + order_by])
+            except UnindexedSort, e:
+                message = unicode(e)
+                order_by = None
+            if order_by:
+                self.data = self.data.order_by(*order_by)
         
         self.data = self.data[start:end]
         
@@ -0,0 +1,39 @@
+# coding: utf-8
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.importlib import import_module
+
+class Command(BaseCommand):
+    '''
+    Corre las exportaciones a Excel pendientes (ver adminextras.admin.jobs)
+    '''
+    help = 'Corre las exportaciones a Excel en segundo plano pendientes'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--loop', action = 'store_true', default = False,
+                    help = 'Sigue esperando trabajos nuevos'),
+        make_option('--interval', type = 'int', default = 5,
+                    help = 'Segundos entre consultas con --loop (5)'),
+        make_option('--purge', type = 'int', default = None,
+                    help = 'Borra los trabajos terminados hace más de estos días'),
+    )
+    can_import_settings = True
+    requires_model_validation = True
+    
+    def handle(self, *args, **options):
+        # Los sitios de administración se registran al cargar las urls
+        import_module(settings.ROOT_URLCONF)
+        from adminextras.admin.jobs import run_pending, purge
+        if options['purge'] is not None:
+            count = purge(datetime.now() - timedelta(days = options['purge']))
+            print "%d exportaciones borradas" % count
+        while True:
+            count = run_pending()
+            if count:
+                print "%d exportaciones generadas" % count
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,56 @@
+# coding: utf-8
+from django.db import models
+from django.contrib.auth.models import User
+
+# Connects the signals that bump the model generations in every process,
+# adminextras.datatables doesn't need to be in INSTALLED_APPS
+import adminextras.datatables.cache
+
+class ExportJob(models.Model):
+    '''
+    Exportación a Excel hecha en segundo plano (ver admin.jobs)
+    '''
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATES = (
+        (PENDING, u'Pendiente'),
+        (RUNNING, u'En curso'),
+        (DONE, u'Terminada'),
+        (FAILED, u'Fallida'),
+    )
+    # Identifica exportaciones iguales, para no repetirlas
+    signature = models.CharField(max_length = 32, db_index = True)
+    user = models.ForeignKey(User)
+    admin_site = models.CharField(max_length = 100)
+    model = models.CharField(max_length = 200)
+    # Los campos y sus títulos, el queryset (pickle en base64)
+    fields = models.TextField()
+    query = models.TextField()
+    state = models.CharField(max_length = 10, choices = STATES, default = PENDING,
+                             db_index = True)
+    rows = models.IntegerField(default = 0)
+    total = models.IntegerField(null = True)
+    filename = models.CharField(max_length = 200, blank = True)
+    path = models.CharField(max_length = 500, blank = True)
+    error = models.TextField(blank = True)
+    created = models.DateTimeField(auto_now_add = True)
+    started = models.DateTimeField(null = True)
+    # Lo actualiza el trabajo en curso, si deja de hacerlo se lo da por muerto
+    updated = models.DateTimeField(null = True)
+    finished = models.DateTimeField(null = True)
+
+    class Meta:
+        ordering = ('-created', )
+        verbose_name = u'exportación'
+        verbose_name_plural = u'exportaciones'
+
+    def __unicode__(self):
+        return u'%s %s (%s)' % (self.model, self.created, self.get_state_display())
+
+    @property
+    def progress(self):
+        ''' Fracción (0 a 1) de las filas escritas, None si no se sabe '''
+        if self.state == self.DONE:
+            return 1.0
+        if not self.total:
+            return None
+        return min(self.rows / float(self.total), 1.0)
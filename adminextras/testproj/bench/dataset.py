@@ -0,0 +1,69 @@
+# encoding: utf-8
+'''
+Datos sintéticos del benchmark, reproducibles (misma semilla, mismos datos).
+Se insertan con executemany de a BATCH_SIZE filas, sin instanciar modelos.
+'''
+import random
+import datetime
+from django.db import connection, transaction
+
+from bench.models import Pais, Provincia, Localidad, Cliente, Factura
+
+BATCH_SIZE = 10000
+ESTADOS = 'ABCX'
+
+def _insert(model, columns, rows):
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table),
+                                               ', '.join(map(qn, columns)),
+                                               ', '.join(['%s'] * len(columns)))
+    cursor = connection.cursor()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            cursor.executemany(sql, batch)
+            transaction.commit_unless_managed()
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
+        transaction.commit_unless_managed()
+
+def generate(rows, seed = 1, clientes = None):
+    '''
+    Borra y genera rows facturas, con sus clientes (rows / 20 por defecto)
+    y su cadena de localidades, provincias y países.
+    '''
+    rnd = random.Random(seed)
+    clientes = clientes or max(rows / 20, 1)
+    if connection.vendor == 'sqlite':
+        connection.cursor().execute('PRAGMA synchronous = OFF')
+    for model in (Factura, Cliente, Localidad, Provincia, Pais):
+        connection.cursor().execute('DELETE FROM %s' % connection.ops.quote_name(model._meta.db_table))
+    transaction.commit_unless_managed()
+
+    _insert(Pais, ('id', 'nombre'), ((n, u'País %d' % n) for n in range(1, 11)))
+    _insert(Provincia, ('id', 'nombre', 'pais_id'),
+            ((n, u'Provincia %d' % n, rnd.randint(1, 10)) for n in range(1, 101)))
+    _insert(Localidad, ('id', 'nombre', 'provincia_id'),
+            ((n, u'Localidad %d' % n, rnd.randint(1, 100)) for n in range(1, 2001)))
+    base = datetime.date(2005, 1, 1)
+    _insert(Cliente, ('id', 'nombre', 'cuit', 'email', 'localidad_id', 'alta'),
+            ((n, u'Cliente %07d' % rnd.randint(0, 9999999), u'20-%08d-1' % n,
+              u'cliente%d@example.com' % n, rnd.randint(1, 2000),
+              base + datetime.timedelta(rnd.randint(0, 2000)))
+             for n in range(1, clientes + 1)))
+    def facturas():
+        for n in range(1, rows + 1):
+            fecha = base + datetime.timedelta(rnd.randint(0, 3000))
+            neto = rnd.randint(100, 10000000)
+            # Montos en float: jq_datatable no serializa Decimal
+            yield (n, rnd.randint(1, clientes), n, fecha,
+                   fecha + datetime.timedelta(30), neto / 100.0,
+                   neto * 21 / 10000.0, neto * 121 / 10000.0,
+                   rnd.choice(ESTADOS), rnd.random() < 0.7,
+                   u'Observaciones de la factura %d ' % n * rnd.randint(1, 4))
+    _insert(Factura, ('id', 'cliente_id', 'numero', 'fecha', 'vencimiento', 'neto',
+                      'iva', 'total', 'estado', 'pagada', 'observaciones'), facturas())
+    if connection.vendor == 'sqlite':
+        connection.cursor().execute('ANALYZE')
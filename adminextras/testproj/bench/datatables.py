@@ -0,0 +1,16 @@
+# encoding: utf-8
+from adminextras.datatables.resources import registry
+from bench.models import Factura
+
+NARROW_COLUMNS = ('numero', 'fecha', 'total')
+WIDE_COLUMNS = ('numero', 'fecha', 'vencimiento', 'neto', 'iva', 'total',
+                'estado', 'pagada', 'observaciones', 'cliente')
+DOTTED_COLUMNS = ('numero', 'cliente.nombre', 'cliente.localidad.nombre',
+                  'cliente.localidad.provincia.nombre',
+                  'cliente.localidad.provincia.pais.nombre')
+
+registry.register(Factura,
+    columns = set(NARROW_COLUMNS + WIDE_COLUMNS + DOTTED_COLUMNS),
+    ordering = ('numero', ),
+    name = 'bench.factura',
+)
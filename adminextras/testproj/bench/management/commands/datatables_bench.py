@@ -0,0 +1,197 @@
+# coding: utf-8
+'''
+Benchmark of the jq_datatable request path, on a synthetic SQLite dataset
+(see bench.dataset). Run it with the bench settings:
+
+    python manage.py datatables_bench --settings=bench_settings --rows=1000000
+
+Every scenario is a datatable request whose phases are timed on their own
+(parse, count, fetch, dump, encode) and then as a whole through the view.
+The result is written as JSON, times in milliseconds.
+'''
+import os
+import sys
+import time
+import platform
+import subprocess
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import RequestFactory
+import django
+
+from adminextras.datatables.views import (DataTableRequest, DataTableResponse,
+    jq_datatable, _get_resource, _get_search_engine, _get_count_strategy, _page_queryset,
+    _dump_page, _dumps_response, json_dumps, json_loads, DATATABLE_PROJECTION)
+from adminextras.datatables.resources import autodiscover
+
+from bench.models import Factura
+from bench.datatables import NARROW_COLUMNS, WIDE_COLUMNS, DOTTED_COLUMNS
+from bench import dataset
+
+PAGE_LENGTH = 50
+
+def scenarios(rows):
+    ''' name -> request arguments '''
+    def arguments(columns, start):
+        return {'sEcho': '1', 'sResource': 'bench.factura',
+                'sColumns': ','.join(columns), 'iColumns': str(len(columns)),
+                'iDisplayStart': str(start), 'iDisplayLength': str(PAGE_LENGTH),
+                'iSortingCols': '1', 'iSortCol_0': '0', 'sSortDir_0': 'asc'}
+    deep = max(rows * 9 / 10 - PAGE_LENGTH, 0)
+    return [
+        ('first_page', arguments(NARROW_COLUMNS, 0)),
+        ('deep_page', arguments(NARROW_COLUMNS, deep)),
+        # Seeks from the sNextCursor of the page before
+        ('deep_page_keyset', dict(arguments(NARROW_COLUMNS, deep), bKeyset = 'true')),
+        ('wide', arguments(WIDE_COLUMNS, 0)),
+        ('dotted', arguments(DOTTED_COLUMNS, 0)),
+        ('dotted_deep_page', arguments(DOTTED_COLUMNS, deep)),
+        ('search', dict(arguments(NARROW_COLUMNS, 0), sSearch = '4242')),
+    ]
+
+class _Null(object):
+    def write(self, data):
+        pass
+
+def _timed(function, *args):
+    begin = time.time()
+    value = function(*args)
+    return (time.time() - begin) * 1000, value
+
+def _summary(times):
+    times = sorted(times)
+    return {'min': round(times[0], 3),
+            'median': round(times[len(times) / 2], 3),
+            'max': round(times[-1], 3)}
+
+def _git_commit():
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout = subprocess.PIPE,
+                                   stderr = subprocess.PIPE,
+                                   cwd = os.path.dirname(__file__))
+        return process.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+class Command(BaseCommand):
+    '''
+    Times the datatable request path
+    '''
+    help = 'Benchmarks jq_datatable phases on a synthetic dataset'
+    args = '[scenario ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type = 'int', default = 100000,
+                    help = 'Facturas of the dataset (default 100000)'),
+        make_option('--repeat', type = 'int', default = 5,
+                    help = 'Times each scenario is run (default 5)'),
+        make_option('--seed', type = 'int', default = 1,
+                    help = 'Seed of the dataset (default 1)'),
+        make_option('--regenerate', action = 'store_true', default = False,
+                    help = 'Generate the dataset even if it has the rows'),
+        make_option('--output', default = None,
+                    help = 'JSON file for the results (default stdout)'),
+    )
+    can_import_settings = True
+    requires_model_validation = True
+
+    def handle(self, *names, **options):
+        rows, repeat = options['rows'], options['repeat']
+        if repeat < 1:
+            raise CommandError("--repeat must be at least 1")
+        autodiscover()
+        if options['regenerate'] or Factura.objects.count() != rows:
+            sys.stderr.write("Generating %d facturas...\n" % rows)
+            seconds, _ = _timed(dataset.generate, rows, options['seed'])
+            sys.stderr.write("Done in %.1fs\n" % (seconds / 1000))
+
+        available = scenarios(rows)
+        unknown = set(names) - set(name for name, _ in available)
+        if unknown:
+            raise CommandError("Unknown scenarios: %s" % ', '.join(sorted(unknown)))
+        factory = RequestFactory()
+        results = {}
+        for name, arguments in available:
+            if names and not name in names:
+                continue
+            sys.stderr.write("%s\n" % name)
+            if 'bKeyset' in arguments:
+                arguments = self.with_cursor(factory, arguments)
+            results[name] = self.run_scenario(factory.get('/', arguments), repeat)
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'rows': rows,
+                'seed': options['seed'],
+                'repeat': repeat,
+                'page_length': PAGE_LENGTH,
+                'database': settings.DATABASES['default']['ENGINE'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'scenarios': results,
+        }
+        output = json_dumps(report, indent = 2, sort_keys = True)
+        if options['output']:
+            open(options['output'], 'w').write(output + '\n')
+        else:
+            print output
+
+    def with_cursor(self, factory, arguments):
+        previous = dict(arguments, iDisplayStart = str(max(int(arguments['iDisplayStart'])
+                                                           - PAGE_LENGTH, 0)))
+        result = json_loads(self.call_view(factory.get('/', previous))[1].content)
+        if not result.get('sNextCursor'):
+            return arguments
+        return dict(arguments, sCursor = result['sNextCursor'])
+
+    def call_view(self, request):
+        # The view prints its sorting arguments
+        stdout, sys.stdout = sys.stdout, _Null()
+        try:
+            seconds, response = _timed(jq_datatable, request)
+        finally:
+            sys.stdout = stdout
+        if '"bSuccess": false' in response.content:
+            raise CommandError(response.content)
+        return seconds, response
+
+    def run_scenario(self, request, repeat):
+        phases = dict((phase, []) for phase in ('parse', 'count', 'fetch', 'dump',
+                                                'encode', 'view'))
+        for _ in range(repeat):
+            self.run_phases(request, phases)
+            phases['view'].append(self.call_view(request)[0])
+        return dict((phase, _summary(times)) for phase, times in phases.items())
+
+    def run_phases(self, request, phases):
+        # The helpers jq_datatable runs, with its defaults
+        def parse():
+            dt_request = DataTableRequest(request)
+            queryset = _get_resource(dt_request, None)
+            queryset = queryset.order_by(*dt_request.order_by_fields)
+            searched_qs, searched = _get_search_engine(dt_request, queryset.model).search(
+                                                                    queryset, dt_request)
+            return dt_request, queryset, searched_qs, searched
+        seconds, (dt_request, queryset, searched_qs, searched) = _timed(parse)
+        phases['parse'].append(seconds)
+
+        # Counts and builds the page queryset, which takes no query
+        result = DataTableResponse(bSuccess = True, sError = '')
+        counter = _get_count_strategy(dt_request)
+        seconds, (page_qs, ordering) = _timed(_page_queryset, result, dt_request, queryset,
+                                              searched_qs, searched, counter,
+                                              DATATABLE_PROJECTION)
+        phases['count'].append(seconds)
+
+        seconds, page = _timed(list, page_qs)
+        phases['fetch'].append(seconds)
+
+        seconds, _ = _timed(_dump_page, result, dt_request, page, dt_request.model,
+                            ordering, counter)
+        phases['dump'].append(seconds)
+
+        seconds, _ = _timed(_dumps_response, result)
+        phases['encode'].append(seconds)
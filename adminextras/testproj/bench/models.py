@@ -0,0 +1,46 @@
+# encoding: utf-8
+'''
+Modelos del benchmark de datatables: una cadena de FKs
+(Factura -> Cliente -> Localidad -> Provincia -> Pais) y una tabla ancha.
+'''
+from django.db import models
+
+class Pais(models.Model):
+    nombre = models.CharField(max_length = 50)
+    def __unicode__(self):
+        return self.nombre
+
+class Provincia(models.Model):
+    nombre = models.CharField(max_length = 50)
+    pais = models.ForeignKey(Pais)
+    def __unicode__(self):
+        return self.nombre
+
+class Localidad(models.Model):
+    nombre = models.CharField(max_length = 50, db_index = True)
+    provincia = models.ForeignKey(Provincia)
+    def __unicode__(self):
+        return self.nombre
+
+class Cliente(models.Model):
+    nombre = models.CharField(max_length = 100, db_index = True)
+    cuit = models.CharField(max_length = 13)
+    email = models.CharField(max_length = 100)
+    localidad = models.ForeignKey(Localidad)
+    alta = models.DateField()
+    def __unicode__(self):
+        return self.nombre
+
+class Factura(models.Model):
+    cliente = models.ForeignKey(Cliente)
+    numero = models.IntegerField(db_index = True)
+    fecha = models.DateField()
+    vencimiento = models.DateField()
+    neto = models.FloatField()
+    iva = models.FloatField()
+    total = models.FloatField()
+    estado = models.CharField(max_length = 1)
+    pagada = models.BooleanField()
+    observaciones = models.TextField()
+    def __unicode__(self):
+        return u'%s %d' % (self.estado, self.numero)
@@ -0,0 +1,15 @@
+# Settings del benchmark de datatables (ver bench/management/commands/datatables_bench.py)
+import os
+from settings import *
+
+DEBUG = False
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', os.path.join(PROJECT_PATH, 'bench.sqlite')),
+    }
+}
+INSTALLED_APPS = INSTALLED_APPS + (
+    'adminextras.datatables',
+    'bench',
+)
@@ -0,0 +1,74 @@
+# coding: utf-8
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.contrib.auth.models import User
+
+from adminextras.datatables.cache import (queryset_signature, response_cache_stats,
+    reset_response_cache_stats)
+from adminextras.datatables.counting import CountStrategy
+from adminextras.datatables.resources import registry
+from adminextras.datatables.views import jq_datatable, jq_datatable_count, json_loads
+
+class GenerationsTest(TestCase):
+    '''
+    Lo cacheado por generaciones (conteos, respuestas, ETags) se invalida
+    al escribir
+    '''
+    def setUp(self):
+        self.user = User.objects.create(username = 'uno')
+
+    def test_write_changes_signature(self):
+        queryset = User.objects.all()
+        before = queryset_signature(queryset)
+        self.user.first_name = 'Uno'
+        self.user.save()
+        self.assertNotEqual(before, queryset_signature(queryset))
+
+    def test_write_changes_etag(self):
+        def get(etag = None):
+            request = RequestFactory().get('/', {'sEcho': '1', 'sColumns': 'username',
+                                                 'iDisplayStart': '0', 'iDisplayLength': '10'})
+            if etag:
+                request.META['HTTP_IF_NONE_MATCH'] = etag
+            return jq_datatable(request, User.objects.all(), conditional = True)
+        etag = get()['ETag']
+        self.assertEqual(get(etag).status_code, 304)
+        User.objects.create(username = 'dos')
+        response = get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_response_cache_shared_by_users(self):
+        reset_response_cache_stats()
+        users = [self.user, User.objects.create(username = 'dos')]
+        etags = []
+        for user in users:
+            request = RequestFactory().get('/', {'sEcho': '1', 'sColumns': 'username',
+                                                 'iDisplayStart': '0', 'iDisplayLength': '10'})
+            request.user = user
+            etags.append(jq_datatable(request, User.objects.filter(pk = self.user.pk),
+                                      conditional = True, cache_timeout = 60)['ETag'])
+        self.assertEqual(response_cache_stats()['hits'], 1)
+        self.assertNotEqual(etags[0], etags[1])
+
+
+class FixedCount(CountStrategy):
+    def count(self, queryset):
+        return 42
+
+class CountStrategyTest(TestCase):
+    '''
+    count/ cuenta como list/, con la estrategia del recurso
+    '''
+    def setUp(self):
+        registry.register(User, name = 'usuarios', columns = ('username',),
+                          count_strategy = FixedCount)
+
+    def tearDown(self):
+        registry.unregister('usuarios')
+
+    def test_resource_strategy(self):
+        request = RequestFactory().get('/', {'sEcho': '1', 'sResource': 'usuarios',
+                                             'sColumns': 'username'})
+        result = json_loads(jq_datatable_count(request).content)
+        self.assertEqual(result['iTotalRecords'], 42)